@@ -0,0 +1,125 @@
+"""
+Loan file I/O shared by the Form 1003 analysis agents.
+
+Loads every JSON file of a loan package, recognizes its Form 1003 files,
+caches LLM responses on disk and saves the Form 1003 analysis report, so both
+agent versions read and write loans the same way.
+"""
+
+import mmap
+import hashlib
+import orjson
+import os
+import re
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+MAX_READ_WORKERS = 16
+MMAP_THRESHOLD_BYTES = 10 * 1024 * 1024
+
+# Filename stems the 1003 is saved under: form_1003, mtg_1003, urla, application,
+# e1003, eapp, optionally followed by a page suffix (_pg1, pg2, _3)
+FORM_1003_STEM_PATTERN = re.compile(r"^(form_?1003|mtg_?1003|urla|application|e?1003|e?app)(_?(pg?)?\d+)?$", re.IGNORECASE)
+
+# LLM response texts cached by request (model, messages, generation parameters)
+CACHE_DIR = Path("loan_docs/_cache/form_1003")
+
+
+def _read_json(json_file):
+    """Parse one JSON file, returning the exception instead of raising it."""
+    try:
+        with open(json_file, 'rb') as f:
+            # Parse large files straight from a read-only mapping instead of
+            # first copying them into a bytes object
+            if os.fstat(f.fileno()).st_size > MMAP_THRESHOLD_BYTES:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                    return orjson.loads(view)
+            return orjson.loads(f.read())
+    except Exception as e:
+        return e
+
+
+def load_all_loan_json_files(loan_id: str) -> Dict[str, Dict]:
+    """Load all JSON files for a given loan."""
+    json_dir = Path(f"loan_docs/{loan_id}/json")
+    
+    if not json_dir.exists():
+        print(f"JSON directory not found: {json_dir}")
+        return {}
+    
+    json_files = {}
+    paths = list(json_dir.glob("*.json"))
+    
+    # File reads are I/O bound: load them on a thread pool (results keep glob order)
+    with ThreadPoolExecutor(max_workers=MAX_READ_WORKERS) as executor:
+        for json_file, data in zip(paths, executor.map(_read_json, paths)):
+            if isinstance(data, Exception):
+                print(f"Error loading {json_file.name}: {data}")
+            else:
+                json_files[json_file.stem] = data
+    
+    return json_files
+
+
+def identify_1003_files_heuristic(json_data: Dict[str, Dict]) -> List[str]:
+    """Find the 1003 files by filename or document type, without calling the LLM."""
+    return [
+        filename for filename, data in json_data.items()
+        if FORM_1003_STEM_PATTERN.match(filename)
+        or 'uniform residential loan application' in str(data.get('document_type', '')).lower()
+    ]
+
+
+def save_1003_analysis(loan_id: str, analysis: Dict, pretty: bool = False):
+    """
+    Save the analysis to a JSON file for downstream processing.
+    
+    The file is compact JSON (downstream agents parse it); pretty=True
+    indents it for reading.
+    """
+    
+    # Save to JSON in loan-specific reports folder
+    report_dir = Path(f"loan_docs/{loan_id}/reports")
+    report_dir.mkdir(parents=True, exist_ok=True)
+    
+    json_file = report_dir / "form_1003_analysis.json"
+    
+    option = orjson.OPT_APPEND_NEWLINE | (orjson.OPT_INDENT_2 if pretty else 0)
+    with open(json_file, 'wb') as f:
+        f.write(orjson.dumps(analysis, option=option))
+    
+    print(f"\n{'='*80}")
+    print(f"💾 Analysis saved to: {json_file}")
+    print(f"{'='*80}\n")
+    
+    return json_file
+
+
+def response_cache_key(request: Dict) -> str:
+    """
+    Fingerprint a chat completions request for the response cache: the model,
+    messages and every generation parameter (response_format, token limit,
+    temperature, seed) all shape the response.
+    """
+    return hashlib.blake2b(
+        orjson.dumps(request, option=orjson.OPT_SORT_KEYS),
+        digest_size=16
+    ).hexdigest()
+
+
+def load_cached_response(cache_key: str):
+    """Return the cached response text for cache_key, or None on a miss."""
+    cache_path = CACHE_DIR / f"{cache_key}.json"
+    if not cache_path.exists():
+        return None
+    return cache_path.read_text(encoding='utf-8')
+
+
+def save_cached_response(cache_key: str, content: str):
+    """Cache a response text, via a temp file + rename so readers never see a partial file."""
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    cache_path = CACHE_DIR / f"{cache_key}.json"
+    tmp_path = cache_path.with_suffix('.tmp')
+    tmp_path.write_text(content, encoding='utf-8')
+    tmp_path.replace(cache_path)
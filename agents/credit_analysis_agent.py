@@ -6,34 +6,93 @@ Focuses on: credit scores, tradelines, payment history, derogatory events,
 credit inquiries, and overall credit profile.
 
 Usage:
-    python agents/credit_analysis_agent.py <loan_id>
+    python agents/credit_analysis_agent.py [--interactive] <loan_id> [<loan_id> ...]
+    python agents/credit_analysis_agent.py --batch <loan_id> [<loan_id> ...]
     
 Example:
     python agents/credit_analysis_agent.py 1000182227
+    python agents/credit_analysis_agent.py --batch 1000182227 1000182005
+
+--interactive (default) calls the chat completions API directly, analyzing
+up to 10 loans concurrently.
+--batch submits all loans as one Azure OpenAI Batch job (24h completion
+window, roughly half the token cost) and waits for the results.
 """
 
 import os
 import sys
 import json
+import random
+import orjson
+import asyncio
+import tempfile
 from pathlib import Path
-from openai import AzureOpenAI
+from concurrent.futures import ThreadPoolExecutor
+from openai import AsyncAzureOpenAI, RateLimitError, APITimeoutError, APIConnectionError, InternalServerError
 from dotenv import load_dotenv
 from datetime import datetime
 
 load_dotenv()
 
-# Initialize Azure OpenAI client
+# Initialize Azure OpenAI client (async)
 endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
 deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT")
 subscription_key = os.getenv("AZURE_OPENAI_KEY")
 api_version = os.getenv("AZURE_OPENAI_API_VERSION")
 
-client = AzureOpenAI(
+client = AsyncAzureOpenAI(
     api_key=subscription_key,
     api_version=api_version,
     azure_endpoint=endpoint
 )
 
+MAX_CONCURRENT_LOANS = 10
+MAX_RETRIES = 3
+MAX_READ_WORKERS = 16
+MAX_COMPLETION_TOKENS = 16000
+
+# COMPACT_PROMPT=1 sends only credit-relevant keys, serialized without indentation
+COMPACT_PROMPT = os.getenv("COMPACT_PROMPT") == "1"
+CREDIT_KEYS = {
+    'document_type', 'summary', 'borrowers', 'credit_scores', 'tradelines',
+    'payment_history', 'derogatory_events', 'inquiries', 'credit_inquiries',
+    'public_records', 'collections', 'utilization', 'credit_utilization'
+}
+
+
+async def create_completion(**kwargs):
+    """Call chat completions, retrying rate limits and server errors with exponential backoff."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return await client.chat.completions.create(**kwargs)
+        except (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError) as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = min(2 ** attempt + random.random(), 60)
+            print(f"⚠️  {type(e).__name__}, retrying in {delay:.1f}s...")
+            await asyncio.sleep(delay)
+
+
+def _read_json(json_file):
+    """Parse one JSON file, returning the exception instead of raising it."""
+    try:
+        return orjson.loads(json_file.read_bytes())
+    except Exception as e:
+        return e
+
+
+def read_json_files(json_files):
+    """
+    Read and parse JSON files on a thread pool, yielding (path, data or
+    exception) in order.
+    
+    orjson parses fast enough that a process pool would spend as long
+    pickling the parsed documents back as it saves.
+    """
+    json_files = list(json_files)
+    with ThreadPoolExecutor(max_workers=MAX_READ_WORKERS) as executor:
+        yield from zip(json_files, executor.map(_read_json, json_files))
+
 
 def load_semantic_json(loan_id):
     """Load all semantic JSON files for a loan."""
@@ -44,59 +103,41 @@ def load_semantic_json(loan_id):
         return {}
     
     semantic_docs = {}
-    for json_file in semantic_dir.glob("*.json"):
+    for json_file, data in read_json_files(semantic_dir.glob("*.json")):
+        if isinstance(data, Exception):
+            print(f"⚠️  Error loading {json_file.name}: {data}")
+            continue
         try:
-            with open(json_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                doc_type = data.get('document_type', 'unknown')
-                # Focus on credit-related documents
-                if 'credit' in doc_type.lower() or 'credit' in json_file.stem.lower():
-                    semantic_docs[json_file.stem] = data
+            doc_type = data.get('document_type', 'unknown')
+            # Focus on credit-related documents
+            if 'credit' in doc_type.lower() or 'credit' in json_file.stem.lower():
+                semantic_docs[json_file.stem] = data
         except Exception as e:
             print(f"⚠️  Error loading {json_file.name}: {e}")
     
     return semantic_docs
 
 
-def analyze_credit(loan_id="1000182227"):
-    """
-    Analyze credit information from semantic JSON files.
-    """
-    
-    print("=" * 80)
-    print(f"Credit Analysis - Loan {loan_id}")
-    print("=" * 80)
-    print()
-    
-    # Load semantic data
-    print("📁 Loading credit-related semantic JSON files...")
-    semantic_docs = load_semantic_json(loan_id)
-    
-    if not semantic_docs:
-        print("❌ No credit documents found!")
-        print("   Looking for any semantic JSON with credit data...")
-        # Fallback: load all semantic docs
-        semantic_dir = Path(f"loan_docs/{loan_id}/semantic_json")
-        for json_file in semantic_dir.glob("*.json"):
-            try:
-                with open(json_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    semantic_docs[json_file.stem] = data
-            except Exception as e:
-                continue
+def _prune_for_credit(doc):
+    """Keep only credit-relevant keys; docs with none are sent whole minus _metadata."""
+    pruned = {key: value for key, value in doc.items() if key in CREDIT_KEYS}
+    if pruned.keys() <= {'document_type', 'summary'}:
+        return {key: value for key, value in doc.items() if key != '_metadata'}
+    return pruned
+
+
+def build_credit_messages(semantic_docs):
+    """Build the chat messages for a credit analysis request."""
     
-    print(f"✅ Loaded {len(semantic_docs)} documents")
-    print()
-    print("=" * 80)
-    print("🔍 Analyzing credit profile...")
-    print("=" * 80)
-    print()
+    if COMPACT_PROMPT:
+        docs_json = orjson.dumps({name: _prune_for_credit(doc) for name, doc in semantic_docs.items()}).decode()
+    else:
+        docs_json = orjson.dumps(semantic_docs, option=orjson.OPT_INDENT_2).decode()
     
-    # Build comprehensive prompt
     prompt = f"""You are a Senior Credit Analyst reviewing a mortgage loan application.
 
 SEMANTIC LOAN DOCUMENTS:
-{json.dumps(semantic_docs, indent=2)}
+{docs_json}
 
 YOUR TASK:
 Extract and summarize ALL credit-related information from the documents. Provide a comprehensive credit analysis.
@@ -223,117 +264,292 @@ OUTPUT FORMAT (JSON only, no markdown):
 
 Be thorough and precise. Extract ALL credit details found in the documents."""
 
-    # Call LLM
-    print("⏳ Analyzing credit data (this may take 30-45 seconds)...")
-    
-    response = client.chat.completions.create(
-        model=deployment,
-        messages=[
-            {
-                "role": "system", 
-                "content": "You are a Senior Credit Analyst with expertise in mortgage underwriting. Output only valid JSON with comprehensive credit analysis."
-            },
-            {
-                "role": "user", 
-                "content": prompt
-            }
-        ],
-        response_format={"type": "json_object"},
-        max_completion_tokens=16000
-    )
+    return [
+        {
+            "role": "system", 
+            "content": "You are a Senior Credit Analyst with expertise in mortgage underwriting. Output only valid JSON with comprehensive credit analysis."
+        },
+        {
+            "role": "user", 
+            "content": prompt
+        }
+    ]
+
+
+def load_credit_documents(loan_id):
+    """Load credit-related semantic JSON, falling back to all semantic docs."""
+    print("📁 Loading credit-related semantic JSON files...")
+    semantic_docs = load_semantic_json(loan_id)
     
-    # Parse response
-    credit_analysis = json.loads(response.choices[0].message.content)
+    if not semantic_docs:
+        print("❌ No credit documents found!")
+        print("   Looking for any semantic JSON with credit data...")
+        # Fallback: load all semantic docs
+        semantic_dir = Path(f"loan_docs/{loan_id}/semantic_json")
+        for json_file, data in read_json_files(semantic_dir.glob("*.json")):
+            if not isinstance(data, Exception):
+                semantic_docs[json_file.stem] = data
     
-    # Add metadata
+    print(f"✅ Loaded {len(semantic_docs)} documents")
+    return semantic_docs
+
+
+def save_credit_analysis(loan_id, credit_analysis, documents_analyzed):
+    """Add metadata to a credit analysis and save it under the loan's reports folder."""
     credit_analysis['_metadata'] = {
         'analysis_date': datetime.now().isoformat(),
         'loan_id': loan_id,
-        'documents_analyzed': len(semantic_docs),
+        'documents_analyzed': documents_analyzed,
         'analyzing_model': deployment,
         'agent': 'credit_analysis_agent'
     }
     
-    # Save output
     output_dir = Path(f"loan_docs/{loan_id}/reports")
     output_dir.mkdir(parents=True, exist_ok=True)
     
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     output_path = output_dir / f"credit_analysis_{loan_id}_{timestamp}.json"
     
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(credit_analysis, f, indent=2, ensure_ascii=False)
+    # Write to a temp file and rename so a killed run never leaves a partial report
+    tmp_path = output_path.with_suffix('.tmp')
+    tmp_path.write_bytes(orjson.dumps(credit_analysis, option=orjson.OPT_INDENT_2))
+    tmp_path.replace(output_path)
     
-    # Display results
-    print()
-    print("=" * 80)
-    print("✅ CREDIT ANALYSIS COMPLETE!")
-    print("=" * 80)
-    print(f"📄 Saved to: {output_path}")
-    print()
+    return output_path
+
+
+def display_credit_summary(credit_analysis, output_path):
+    """Print a summary of a saved credit analysis (built up, then written once)."""
+    lines = [
+        "",
+        "=" * 80,
+        "✅ CREDIT ANALYSIS COMPLETE!",
+        "=" * 80,
+        f"📄 Saved to: {output_path}",
+        "",
+        "📊 CREDIT SUMMARY:",
+    ]
     
     # Summary
     borrowers = credit_analysis.get('borrowers', [])
-    print("📊 CREDIT SUMMARY:")
     for borrower in borrowers:
         name = borrower.get('name', 'Unknown')
         scores = borrower.get('credit_scores', {})
-        print(f"\n   👤 {name}")
-        print(f"      FICO: {scores.get('lowest_score', 'N/A')} (lowest) | {scores.get('middle_score', 'N/A')} (middle)")
+        lines.append(f"\n   👤 {name}")
+        lines.append(f"      FICO: {scores.get('lowest_score', 'N/A')} (lowest) | {scores.get('middle_score', 'N/A')} (middle)")
         if scores.get('experian'):
-            print(f"      Experian: {scores.get('experian')}")
+            lines.append(f"      Experian: {scores.get('experian')}")
         if scores.get('transunion'):
-            print(f"      TransUnion: {scores.get('transunion')}")
+            lines.append(f"      TransUnion: {scores.get('transunion')}")
         if scores.get('equifax'):
-            print(f"      Equifax: {scores.get('equifax')}")
+            lines.append(f"      Equifax: {scores.get('equifax')}")
     
     report_summary = credit_analysis.get('credit_report_summary', {})
-    print(f"\n   📋 Report Type: {report_summary.get('report_type', 'N/A')}")
-    print(f"   📅 Report Date: {report_summary.get('report_date', 'N/A')}")
-    print(f"   📊 Total Accounts: {report_summary.get('total_accounts', 0)}")
-    print(f"   ✅ Open Accounts: {report_summary.get('open_accounts', 0)}")
-    
     payment_history = credit_analysis.get('payment_history', {})
-    print(f"\n   🏠 Housing History (12mo): {payment_history.get('housing_history_12_months', 'N/A')}")
-    print(f"   ⚠️  Total Delinquencies (24mo): {payment_history.get('total_delinquencies_24_months', 0)}")
+    lines.append(f"""
+   📋 Report Type: {report_summary.get('report_type', 'N/A')}
+   📅 Report Date: {report_summary.get('report_date', 'N/A')}
+   📊 Total Accounts: {report_summary.get('total_accounts', 0)}
+   ✅ Open Accounts: {report_summary.get('open_accounts', 0)}
+
+   🏠 Housing History (12mo): {payment_history.get('housing_history_12_months', 'N/A')}
+   ⚠️  Total Delinquencies (24mo): {payment_history.get('total_delinquencies_24_months', 0)}""")
     
     derogatory = credit_analysis.get('derogatory_events', [])
     if derogatory:
-        print(f"\n   🚨 Derogatory Events: {len(derogatory)}")
+        lines.append(f"\n   🚨 Derogatory Events: {len(derogatory)}")
         for event in derogatory[:3]:  # Show first 3
-            print(f"      - {event.get('type', 'Unknown')}: {event.get('date', 'N/A')} ({event.get('status', 'N/A')})")
+            lines.append(f"      - {event.get('type', 'Unknown')}: {event.get('date', 'N/A')} ({event.get('status', 'N/A')})")
     
     utilization = credit_analysis.get('credit_utilization', {})
     if utilization.get('utilization_percentage'):
-        print(f"\n   💳 Credit Utilization: {utilization.get('utilization_percentage', 0):.1f}%")
+        lines.append(f"\n   💳 Credit Utilization: {utilization.get('utilization_percentage', 0):.1f}%")
     
     uw_notes = credit_analysis.get('underwriting_notes', {})
-    print(f"\n   📝 Overall Credit Quality: {uw_notes.get('overall_credit_quality', 'N/A')}")
-    print(f"   ✅ Recommendation: {uw_notes.get('recommendation', 'N/A')}")
+    lines.append(f"\n   📝 Overall Credit Quality: {uw_notes.get('overall_credit_quality', 'N/A')}")
+    lines.append(f"   ✅ Recommendation: {uw_notes.get('recommendation', 'N/A')}")
     
     # Strengths and Concerns
     strengths = credit_analysis.get('credit_strengths', [])
     if strengths:
-        print(f"\n   ✨ Credit Strengths ({len(strengths)}):")
-        for strength in strengths[:3]:
-            print(f"      • {strength}")
+        lines.append(f"\n   ✨ Credit Strengths ({len(strengths)}):")
+        lines.extend(f"      • {strength}" for strength in strengths[:3])
     
     concerns = credit_analysis.get('credit_concerns', [])
     if concerns:
-        print(f"\n   ⚠️  Credit Concerns ({len(concerns)}):")
-        for concern in concerns[:3]:
-            print(f"      • {concern}")
+        lines.append(f"\n   ⚠️  Credit Concerns ({len(concerns)}):")
+        lines.extend(f"      • {concern}" for concern in concerns[:3])
+    
+    lines.append("")
+    lines.append("=" * 80)
+    sys.stdout.write("\n".join(lines) + "\n")
+
+
+async def analyze_credit(loan_id="1000182227"):
+    """
+    Analyze credit information from semantic JSON files.
+    """
+    
+    print("=" * 80)
+    print(f"Credit Analysis - Loan {loan_id}")
+    print("=" * 80)
+    print()
     
+    # Load semantic data off the event loop (file reads and parsing block)
+    # so the other loans' requests keep running meanwhile
+    semantic_docs = await asyncio.to_thread(load_credit_documents, loan_id)
     print()
     print("=" * 80)
+    print("🔍 Analyzing credit profile...")
+    print("=" * 80)
+    print()
+    
+    # Call LLM
+    print("⏳ Analyzing credit data (this may take 30-45 seconds)...")
+    
+    # Size the output budget to the document count; retry at the ceiling if truncated
+    messages = build_credit_messages(semantic_docs)
+    output_budget = min(MAX_COMPLETION_TOKENS, 2000 + 400 * len(semantic_docs))
+    response = await create_completion(
+        model=deployment,
+        messages=messages,
+        response_format={"type": "json_object"},
+        max_completion_tokens=output_budget
+    )
+    if response.choices[0].finish_reason == "length" and output_budget < MAX_COMPLETION_TOKENS:
+        print(f"⚠️  Output truncated at {output_budget} tokens, retrying with {MAX_COMPLETION_TOKENS}...")
+        response = await create_completion(
+            model=deployment,
+            messages=messages,
+            response_format={"type": "json_object"},
+            max_completion_tokens=MAX_COMPLETION_TOKENS
+        )
+    
+    # Parse response
+    credit_analysis = orjson.loads(response.choices[0].message.content)
+    
+    output_path = save_credit_analysis(loan_id, credit_analysis, len(semantic_docs))
+    display_credit_summary(credit_analysis, output_path)
     
     return credit_analysis
 
 
+async def analyze_credits(loan_ids):
+    """
+    Analyze credit for many loans concurrently (at most MAX_CONCURRENT_LOANS in flight).
+    """
+    sem = asyncio.Semaphore(MAX_CONCURRENT_LOANS)
+    
+    async def analyze_one(loan_id):
+        async with sem:
+            try:
+                return await analyze_credit(loan_id)
+            except Exception as e:
+                print(f"❌ Error analyzing loan {loan_id}: {e}")
+                return None
+    
+    results = await asyncio.gather(*(analyze_one(loan_id) for loan_id in loan_ids))
+    return dict(zip(loan_ids, results))
+
+
+async def submit_batch(loan_ids):
+    """
+    Analyze credit for many loans through the Azure OpenAI Batch API.
+    
+    Writes one JSONL request per loan (custom_id = loan_id), submits a single
+    batch job, polls with exponential backoff until it finishes, then saves
+    each result as credit_analysis_{loan_id}_{timestamp}.json.
+    """
+    
+    print("=" * 80)
+    print(f"Credit Analysis Batch - {len(loan_ids)} loans")
+    print("=" * 80)
+    print()
+    
+    documents_analyzed = {}
+    with tempfile.NamedTemporaryFile('w', suffix='.jsonl', encoding='utf-8', delete=False) as f:
+        batch_input_path = Path(f.name)
+        for loan_id in loan_ids:
+            semantic_docs = load_credit_documents(loan_id)
+            documents_analyzed[loan_id] = len(semantic_docs)
+            request = {
+                "custom_id": loan_id,
+                "method": "POST",
+                "url": "/chat/completions",
+                "body": {
+                    "model": deployment,
+                    "messages": build_credit_messages(semantic_docs),
+                    "response_format": {"type": "json_object"},
+                    "max_completion_tokens": MAX_COMPLETION_TOKENS
+                }
+            }
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+    
+    try:
+        with open(batch_input_path, 'rb') as f:
+            batch_file = await client.files.create(file=f, purpose="batch")
+    finally:
+        batch_input_path.unlink()
+    
+    batch = await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/chat/completions",
+        completion_window="24h"
+    )
+    print(f"\n📤 Submitted batch {batch.id} ({len(loan_ids)} requests)")
+    
+    # Poll with exponential backoff (30s doubling up to 10 minutes)
+    delay = 30
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        print(f"⏳ Batch status: {batch.status} - checking again in {delay}s")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 600)
+        batch = await client.batches.retrieve(batch.id)
+    
+    if batch.status != "completed":
+        print(f"❌ Batch {batch.id} finished with status: {batch.status}")
+        return {}
+    
+    # Requests the service rejected are only listed in the error file
+    if batch.error_file_id:
+        errors = (await client.files.content(batch.error_file_id)).text
+        for line in errors.splitlines():
+            if not line.strip():
+                continue
+            record = orjson.loads(line)
+            response = record.get('response') or {}
+            print(f"❌ Loan {record['custom_id']} failed: {record.get('error') or response.get('body')}")
+    
+    results = {}
+    output = (await client.files.content(batch.output_file_id)).text if batch.output_file_id else ""
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        record = orjson.loads(line)
+        loan_id = record['custom_id']
+        response = record.get('response') or {}
+        if record.get('error') or response.get('status_code') != 200:
+            print(f"❌ Loan {loan_id} failed: {record.get('error') or response.get('body')}")
+            continue
+        
+        credit_analysis = orjson.loads(response['body']['choices'][0]['message']['content'])
+        output_path = save_credit_analysis(loan_id, credit_analysis, documents_analyzed.get(loan_id, 0))
+        print(f"✅ Loan {loan_id}: saved to {output_path}")
+        results[loan_id] = credit_analysis
+    
+    print()
+    print(f"✅ Batch complete: {len(results)}/{len(loan_ids)} loans analyzed")
+    return results
+
+
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        loan_id = sys.argv[1]
-    else:
-        loan_id = "1000182227"
+    args = sys.argv[1:]
+    batch_mode = "--batch" in args
+    loan_ids = [arg for arg in args if arg not in ("--batch", "--interactive")] or ["1000182227"]
     
-    analyze_credit(loan_id)
+    if batch_mode:
+        asyncio.run(submit_batch(loan_ids))
+    elif len(loan_ids) == 1:
+        asyncio.run(analyze_credit(loan_ids[0]))
+    else:
+        asyncio.run(analyze_credits(loan_ids))
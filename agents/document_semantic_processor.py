@@ -14,63 +14,220 @@ Example:
 
 import os
 import sys
-import json
+import orjson
+import re
+import random
 import asyncio
+import hashlib
+import functools
+import httpx
 from pathlib import Path
-from openai import AsyncAzureOpenAI
+from openai import AsyncAzureOpenAI, RateLimitError, APITimeoutError
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# Initialize Azure OpenAI client (async)
+# Azure OpenAI settings
 endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
 deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT")
 subscription_key = os.getenv("AZURE_OPENAI_KEY")
 api_version = os.getenv("AZURE_OPENAI_API_VERSION")
 
-client = AsyncAzureOpenAI(
-    api_key=subscription_key,
-    api_version=api_version,
-    azure_endpoint=endpoint
-)
+# Shared Azure OpenAI client over one pooled HTTP/2 connection set, created on
+# first use (importing the module needs no credentials) and closed by
+# close_client() before its event loop ends
+_client = None
 
+def get_client():
+    """Return the shared Azure OpenAI client, creating it on first use."""
+    global _client
+    if _client is None:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=64, keepalive_expiry=60),
+            timeout=httpx.Timeout(120.0, connect=10.0),
+            http2=True
+        )
+        _client = AsyncAzureOpenAI(
+            api_key=subscription_key,
+            api_version=api_version,
+            azure_endpoint=endpoint,
+            http_client=http_client
+        )
+    return _client
+
+async def close_client():
+    """Close the shared client and its connection pool (call before the event loop ends)."""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+# Documents processed concurrently per loan (keeps bursts inside Azure TPM/RPM limits)
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "8"))
+MAX_RETRIES = 3
+# Per-document progress output during loan-wide runs (VERBOSE=1 to enable)
+VERBOSE = os.getenv("VERBOSE") == "1"
+# Documents longer than the model context (minus room for instructions and
+# output) are split into chunks; ~4 characters per token
+MODEL_CONTEXT_TOKENS = int(os.getenv("MODEL_CONTEXT_TOKENS", "128000"))
+MAX_CHUNK_CHARS = (MODEL_CONTEXT_TOKENS - 8000) * 4
+MAX_CHUNKS = 8
+PAGE_BREAK = re.compile(r"\f|<!-- PageBreak -->")
+# Raw JSON files read ahead of the workers while LLM calls are in flight
+MAX_PREFETCH = 4
+
+# Semantic outputs cached by (raw JSON bytes, deployment, schema text, chunk
+# size, PROMPT_VERSION); bump PROMPT_VERSION whenever the prompts change
+CACHE_DIR = Path("loan_docs/_cache/semantic")
+PROMPT_VERSION = "v2"
+
+# LLM calls keyed by prompt input, shared by duplicate documents (blank pages,
+# re-scans) so identical content is only sent once per process
+_extractions = {}
+
+def _write_atomic(path, payload):
+    """Write bytes via a temp file + rename so readers never see a partial file."""
+    path = Path(path)
+    tmp_path = path.with_suffix('.tmp')
+    tmp_path.write_bytes(payload)
+    tmp_path.replace(path)
+
+def _cache_key(raw_bytes, deployment, schema_info):
+    """Fingerprint a raw document + model + schema prompt + prompt version for the semantic output cache."""
+    key = hashlib.blake2b(raw_bytes, digest_size=16)
+    key.update(f"{deployment or ''}|{schema_info}|{MAX_CHUNK_CHARS}|{PROMPT_VERSION}".encode())
+    return key.hexdigest()
+
+async def create_completion(**kwargs):
+    """Call chat completions, retrying rate limits and timeouts with exponential backoff."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return await get_client().chat.completions.create(**kwargs)
+        except (RateLimitError, APITimeoutError) as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = min(2 ** attempt + random.random(), 60)
+            print(f"⚠️  {type(e).__name__}, retrying in {delay:.1f}s...")
+            await asyncio.sleep(delay)
+
+@functools.lru_cache(maxsize=32)
 def load_schema(schema_name):
-    """Load a document schema from utils/"""
-    schema_path = Path(f"utils/{schema_name}")
-    with open(schema_path, 'r') as f:
-        return json.load(f)
+    """
+    Load a document schema from utils/ (cached; schemas are static).
+    
+    Returns (schema, schema_json) where schema_json is the indented JSON
+    text embedded in prompts, serialized once per schema.
+    """
+    schema = orjson.loads(Path(f"utils/{schema_name}").read_bytes())
+    return schema, orjson.dumps(schema, option=orjson.OPT_INDENT_2).decode()
 
-async def process_document(raw_json_path, output_path, document_type="auto_detect"):
+@functools.lru_cache(maxsize=32)
+def schema_prompt(document_type):
+    """The schema instructions embedded in the prompt for a document type (cached)."""
+    if document_type == "auto_detect":
+        # Let the LLM detect the document type
+        return "You will determine the document type from: alta_settlement_statement, title_commitment, appraisal, w2, paystub, credit_report, mortgage_statement, insurance, form_1003"
+    try:
+        _, schema_json = load_schema(f"{document_type}_schema.json")
+        return f"Use this JSON schema: {schema_json}"
+    except FileNotFoundError:
+        return "No specific schema found. Create appropriate structured output."
+
+def parse_raw_document(raw_bytes, document_type):
     """
-    Process a raw Document Intelligence JSON into semantic JSON.
+    Parse raw Document Intelligence JSON bytes and return
+    (content, table_count, document_name, cache_key).
     
-    Args:
-        raw_json_path: Path to raw JSON from Document Intelligence
-        output_path: Path to save semantic JSON
-        document_type: Type of document (or "auto_detect")
+    Only these fields are used downstream, so the full pages/paragraphs/styles
+    tree is released here instead of being held across the LLM call.
+    """
+    raw_doc = orjson.loads(raw_bytes)
+    return (
+        raw_doc.get('content', ''),
+        len(raw_doc.get('tables', [])),
+        raw_doc.get('document_name'),
+        _cache_key(raw_bytes, deployment, schema_prompt(document_type))
+    )
+
+def load_raw_document(raw_json_path, document_type):
+    """Read and parse a raw Document Intelligence JSON file (see parse_raw_document)."""
+    return parse_raw_document(Path(raw_json_path).read_bytes(), document_type)
+
+def split_content(content, max_chars):
     """
+    Split document content into chunks of at most max_chars, breaking on page
+    delimiters (form feeds / DI page-break markers) or, failing that, paragraphs.
+    """
+    if len(content) <= max_chars:
+        return [content]
     
-    # Load raw document
-    with open(raw_json_path, 'r', encoding='utf-8') as f:
-        raw_doc = json.load(f)
+    pages = PAGE_BREAK.split(content)
+    if len(pages) == 1:
+        pages = content.split("\n\n")
     
-    # Get the content
-    content = raw_doc.get('content', '')
+    chunks = []
+    current = ""
+    for page in pages:
+        # A single page over the budget is hard-split
+        while len(page) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(page[:max_chars])
+            page = page[max_chars:]
+        if current and len(current) + len(page) + 1 > max_chars:
+            chunks.append(current)
+            current = page
+        else:
+            current = f"{current}\n{page}" if current else page
+    if current:
+        chunks.append(current)
+    return chunks
+
+def merge_semantic(parts):
+    """
+    Merge semantic JSON extracted from chunks of one document: nested objects
+    merge recursively, lists concatenate, and the first non-empty scalar wins.
+    """
+    merged = {}
+    for part in parts:
+        for key, value in part.items():
+            current = merged.get(key)
+            if current in (None, "", [], {}):
+                merged[key] = value
+            elif isinstance(current, dict) and isinstance(value, dict):
+                merged[key] = merge_semantic([current, value])
+            elif isinstance(current, list) and isinstance(value, list):
+                merged[key] = current + value
+    return merged
+
+async def extract_semantic(content, table_count, schema_info, part_note=""):
+    """Send document content to the LLM and return the parsed semantic JSON."""
     
-    # Also include table count as context
-    table_count = len(raw_doc.get('tables', []))
+    # Identical prompt already sent (or in flight): wait on that call instead.
+    # The key covers every prompt input; the filename is kept out of the
+    # prompt so equal documents under different names share one call
+    key = hashlib.blake2b(
+        f"{table_count}|{schema_info}|{part_note}|{content}".encode(), digest_size=16
+    ).hexdigest()
+    extraction = _extractions.get(key)
+    if extraction is None:
+        extraction = asyncio.ensure_future(
+            _request_semantic(content, table_count, schema_info, part_note)
+        )
+        _extractions[key] = extraction
+        
+        # Failed calls are retried by the next caller rather than shared
+        def forget_failed(task):
+            if task.cancelled() or task.exception():
+                _extractions.pop(key, None)
+        extraction.add_done_callback(forget_failed)
     
-    # Load appropriate schema based on document type
-    if document_type == "auto_detect":
-        # Let the LLM detect the document type
-        schema_info = "You will determine the document type from: alta_settlement_statement, title_commitment, appraisal, w2, paystub, credit_report, mortgage_statement, insurance, form_1003"
-    else:
-        schema_path = f"{document_type}_schema.json"
-        try:
-            schema = load_schema(schema_path)
-            schema_info = f"Use this JSON schema: {json.dumps(schema, indent=2)}"
-        except FileNotFoundError:
-            schema_info = "No specific schema found. Create appropriate structured output."
+    # Each caller parses its own copy, since process_document adds metadata
+    return orjson.loads(await asyncio.shield(extraction))
+
+async def _request_semantic(content, table_count, schema_info, part_note):
+    """Build the semantic extraction prompt and return the raw LLM response text."""
     
     # Build prompt
     prompt = f"""You are a Mortgage Loan Document Processor AI with expertise in understanding and extracting semantic meaning from loan documents.
@@ -79,8 +236,7 @@ INPUT DOCUMENT:
 {content}
 
 METADATA:
-- Document has {table_count} tables
-- Original filename: {raw_doc.get('document_name', 'unknown')}
+- Document has {table_count} tables{part_note}
 
 YOUR TASK:
 1. Identify the document type
@@ -111,11 +267,7 @@ OUTPUT FORMAT:
 
 Remember: The goal is to compress the content down to essential semantic data while keeping 100% of the value for a loan processor."""
 
-    # Call LLM
-    print(f"📤 Sending to LLM for semantic processing...")
-    print(f"   Input size: {len(content)} chars ({len(content)//4} tokens approx)")
-    
-    response = await client.chat.completions.create(
+    response = await create_completion(
         model=deployment,
         messages=[
             {"role": "system", "content": "You are an expert Mortgage Loan Document Processor. Output only valid JSON, no markdown."},
@@ -124,26 +276,94 @@ Remember: The goal is to compress the content down to essential semantic data wh
         response_format={"type": "json_object"}
     )
     
-    # Parse response
-    semantic_json = json.loads(response.choices[0].message.content)
+    return response.choices[0].message.content
+
+async def process_document(raw_json_path, output_path, document_type="auto_detect", raw_bytes=None, verbose=True):
+    """
+    Process a raw Document Intelligence JSON into semantic JSON.
+    
+    Args:
+        raw_json_path: Path to raw JSON from Document Intelligence
+        output_path: Path to save semantic JSON
+        document_type: Type of document (or "auto_detect")
+        raw_bytes: Contents of raw_json_path if already read (prefetched)
+        verbose: Print per-document progress
+    """
+    
+    # Load raw document (content, table count as context, original filename)
+    if raw_bytes is None:
+        content, table_count, source_file, cache_key = await asyncio.to_thread(
+            load_raw_document, raw_json_path, document_type
+        )
+    else:
+        content, table_count, source_file, cache_key = await asyncio.to_thread(
+            parse_raw_document, raw_bytes, document_type
+        )
+        del raw_bytes
+    
+    # Identical raw JSON already processed with this model, schema and prompt: reuse it
+    cache_path = CACHE_DIR / f"{cache_key}.json"
+    if cache_path.exists():
+        cached = cache_path.read_bytes()
+        _write_atomic(output_path, cached)
+        if verbose:
+            print(f"♻️  Cache hit for {source_file or raw_json_path}, skipped LLM call\n"
+                  f"   Saved to: {output_path}")
+        return orjson.loads(cached)
+    
+    # Load appropriate schema based on document type
+    schema_info = schema_prompt(document_type)
+    
+    # Content past the model context would fail only after a full round trip:
+    # split it on page boundaries and extract the chunks in parallel instead
+    chunks = split_content(content, MAX_CHUNK_CHARS)
+    if len(chunks) > MAX_CHUNKS:
+        raise ValueError(
+            f"{source_file or raw_json_path} is too large to process: "
+            f"~{len(content)//4} tokens would need {len(chunks)} chunks (max {MAX_CHUNKS})"
+        )
+    
+    # Call LLM
+    if verbose:
+        print(f"📤 Sending to LLM for semantic processing...\n"
+              f"   Input size: {len(content)} chars ({len(content)//4} tokens approx)"
+              + (f", split into {len(chunks)} chunks" if len(chunks) > 1 else ""))
+    
+    if len(chunks) == 1:
+        semantic_json = await extract_semantic(content, table_count, schema_info)
+    else:
+        parts = await asyncio.gather(*(
+            extract_semantic(
+                chunk, table_count, schema_info,
+                part_note=f"\n- This is part {i} of {len(chunks)} of the document"
+            )
+            for i, chunk in enumerate(chunks, 1)
+        ))
+        semantic_json = merge_semantic(parts)
+    
+    # Measure the semantic payload once (before metadata) for size/compression stats
+    output_size = len(orjson.dumps(semantic_json))
+    compression = len(content) / output_size
     
     # Add metadata
     semantic_json['_metadata'] = {
-        'source_file': raw_doc.get('document_name'),
+        'source_file': source_file,
         'processing_model': deployment,
         'raw_content_length': len(content),
-        'compression_ratio': f"{len(content) / len(json.dumps(semantic_json)):.1f}x"
+        'compression_ratio': f"{compression:.1f}x"
     }
     
-    # Save output
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(semantic_json, f, indent=2, ensure_ascii=False)
+    # Save output and cache it for identical inputs
+    serialized = orjson.dumps(semantic_json, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    _write_atomic(output_path, serialized)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    _write_atomic(cache_path, serialized)
     
-    output_size = len(json.dumps(semantic_json))
-    print(f"✅ Semantic processing complete!")
-    print(f"   Output size: {output_size} chars ({output_size//4} tokens approx)")
-    print(f"   Compression: {len(content) / output_size:.1f}x")
-    print(f"   Saved to: {output_path}")
+    if verbose:
+        print(f"✅ Semantic processing complete!\n"
+              f"   Output size: {output_size} chars ({output_size//4} tokens approx)\n"
+              f"   Compression: {compression:.1f}x\n"
+              f"   Saved to: {output_path}")
     
     return semantic_json
 
@@ -167,21 +387,25 @@ async def process_loan_documents(loan_id="1000182227"):
     print(f"Processing {len(json_files)} documents for loan {loan_id}")
     print(f"Raw JSON: {raw_json_dir}/")
     print(f"Output: {semantic_json_dir}/")
-    print("Processing in parallel with async I/O...")
+    print(f"Processing in parallel with async I/O (max {MAX_CONCURRENCY} concurrent)...")
     print("=" * 80)
     print()
     
-    # Create tasks for all documents
-    async def process_single(json_file):
+    async def process_single(json_file, raw_bytes):
         """Process a single document and return result."""
-        print(f"📄 Processing: {json_file.name}")
+        if VERBOSE:
+            print(f"📄 Processing: {json_file.name}")
         output_path = semantic_json_dir / json_file.name
         
         try:
+            if isinstance(raw_bytes, Exception):
+                raise raw_bytes
             semantic_doc = await process_document(
                 raw_json_path=json_file,
                 output_path=output_path,
-                document_type="auto_detect"
+                document_type="auto_detect",
+                raw_bytes=raw_bytes,
+                verbose=VERBOSE
             )
             return {
                 'file': json_file.name,
@@ -190,39 +414,63 @@ async def process_loan_documents(loan_id="1000182227"):
                 'compression': semantic_doc['_metadata']['compression_ratio']
             }
         except Exception as e:
-            print(f"❌ Error processing {json_file.name}: {e}")
+            if VERBOSE:
+                print(f"❌ Error processing {json_file.name}: {e}")
             return {
                 'file': json_file.name,
                 'status': 'error',
                 'error': str(e)
             }
     
-    # Process all documents in parallel
-    tasks = [process_single(json_file) for json_file in json_files]
-    results = await asyncio.gather(*tasks)
+    # A producer reads files up to MAX_PREFETCH ahead; MAX_CONCURRENCY workers
+    # parse them and call the LLM, so disk reads overlap in-flight requests
+    queue = asyncio.Queue(maxsize=MAX_PREFETCH)
+    results = [None] * len(json_files)
+    workers = min(MAX_CONCURRENCY, len(json_files))
     
-    # Summary
-    print("\n" + "=" * 80)
-    print("PROCESSING SUMMARY")
-    print("=" * 80)
+    async def produce():
+        for index, json_file in enumerate(json_files):
+            try:
+                raw_bytes = await asyncio.to_thread(json_file.read_bytes)
+            except Exception as e:
+                raw_bytes = e
+            await queue.put((index, json_file, raw_bytes))
+        for _ in range(workers):
+            await queue.put(None)
     
+    async def consume():
+        while (item := await queue.get()) is not None:
+            index, json_file, raw_bytes = item
+            results[index] = await process_single(json_file, raw_bytes)
+    
+    try:
+        await asyncio.gather(produce(), *(consume() for _ in range(workers)))
+    finally:
+        await close_client()
+    
+    # Summary (written once, after all documents finish)
     successful = [r for r in results if r['status'] == 'success']
     failed = [r for r in results if r['status'] == 'error']
     
-    print(f"✅ Successful: {len(successful)}/{len(results)}")
-    print(f"❌ Failed: {len(failed)}/{len(results)}")
+    lines = [
+        "",
+        "=" * 80,
+        "PROCESSING SUMMARY",
+        "=" * 80,
+        f"✅ Successful: {len(successful)}/{len(results)}",
+        f"❌ Failed: {len(failed)}/{len(results)}",
+    ]
     
     if successful:
-        print("\nDocument Types Processed:")
-        for r in successful:
-            print(f"  - {r['file']}: {r['type']} (compressed {r['compression']})")
+        lines.append("\nDocument Types Processed:")
+        lines.extend(f"  - {r['file']}: {r['type']} (compressed {r['compression']})" for r in successful)
     
     if failed:
-        print("\nErrors:")
-        for r in failed:
-            print(f"  - {r['file']}: {r['error']}")
+        lines.append("\nErrors:")
+        lines.extend(f"  - {r['file']}: {r['error']}" for r in failed)
     
-    print("\n" + "=" * 80)
+    lines.append("\n" + "=" * 80)
+    sys.stdout.write("\n".join(lines) + "\n")
 
 
 if __name__ == "__main__":
@@ -237,7 +485,14 @@ if __name__ == "__main__":
         raw_path = Path(f"loan_docs/{loan_id}/json/{doc_name}")
         output_path = Path(f"loan_docs/{loan_id}/semantic_json/{doc_name}")
         output_path.parent.mkdir(parents=True, exist_ok=True)
-        asyncio.run(process_document(raw_path, output_path))
+        
+        async def run():
+            try:
+                await process_document(raw_path, output_path)
+            finally:
+                await close_client()
+        
+        asyncio.run(run())
     else:
         # Process all documents in parallel
         asyncio.run(process_loan_documents(loan_id))
@@ -23,15 +23,18 @@ Example:
     python agents/document_timeline_agent.py 1000182005
 """
 
-import json
+import orjson
 import os
 import sys
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from openai import AzureOpenAI
 from dotenv import load_dotenv
 import re
+import functools
 from collections import defaultdict
+from typing import Optional, Union
 
 load_dotenv()
 
@@ -41,6 +44,22 @@ AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_KEY")
 AZURE_OPENAI_DEPLOYMENT = os.getenv("AZURE_OPENAI_DEPLOYMENT", "gpt-4o-mini")
 AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2024-08-01-preview")
 
+# Threads used to read and parse a loan's semantic JSON files
+MAX_READ_WORKERS = 32
+# The only semantic JSON fields the timeline reads; the rest is dropped on load
+TIMELINE_FIELDS = ('document_type', 'summary', 'key_entities', 'key_dates')
+
+# Common date patterns in one alternation (single pass over the text); the
+# matching group's name selects how the date is parsed
+_DATE_RE = re.compile(
+    r'\b(?P<mdy>\d{1,2}/\d{1,2}/\d{4})\b'    # MM/DD/YYYY
+    r'|\b(?P<iso>\d{4}-\d{2}-\d{2})\b'       # YYYY-MM-DD
+    r'|\b(?P<mdy2>\d{1,2}-\d{1,2}-\d{4})\b'  # MM-DD-YYYY
+)
+_DATE_SEPARATORS = {'mdy': '/', 'mdy2': '-'}
+# Cheap prefilter: text without a digit (most filenames) can't hold a date
+_HAS_DIGIT = re.compile(r'\d').search
+
 
 # Document type categories aligned with loan lifecycle
 DOCUMENT_CATEGORIES = {
@@ -172,6 +191,43 @@ DOCUMENT_CATEGORIES = {
     }
 }
 
+# Category names and their lowercased keywords as parallel tuples, computed
+# once for categorize_document
+_CATEGORY_NAMES = tuple(DOCUMENT_CATEGORIES)
+_CATEGORY_KEYWORDS = tuple(
+    tuple(keyword.lower() for keyword in info['keywords'])
+    for info in DOCUMENT_CATEGORIES.values()
+)
+# Most keywords any category after index i could still match: once the best
+# score reaches it, no later category can win and scoring can stop early
+_REMAINING_MAX_SCORE = tuple(
+    max(map(len, _CATEGORY_KEYWORDS[i + 1:]), default=0)
+    for i in range(len(_CATEGORY_KEYWORDS))
+)
+# Display order of LLM loan stages and categories
+_STAGE_ORDER = (
+    "Application", "Credit Pull", "Home Valuation",
+    "Income Verification", "Asset Verification",
+    "Additional Documentation", "Underwriting Decision",
+    "Pre-Closing", "Closing", "Funding"
+)
+_CATEGORY_PRIORITY = {category: info['priority'] for category, info in DOCUMENT_CATEGORIES.items()}
+
+
+def _load_one(json_file: Path) -> Union[dict, Exception]:
+    """Load one semantic JSON file, returning the exception instead of raising it."""
+    try:
+        raw = orjson.loads(json_file.read_bytes())
+        if not isinstance(raw, dict):
+            raise ValueError(f"expected a JSON object, got {type(raw).__name__}")
+        data = {field: raw[field] for field in TIMELINE_FIELDS if field in raw}
+        # Include filename for reference
+        data['source_filename'] = json_file.name
+        data['source_path'] = str(json_file)
+        return data
+    except Exception as e:
+        return e
+
 
 def load_semantic_json_files(loan_id: str) -> list[dict]:
     """Load all semantic JSON files for the loan."""
@@ -189,90 +245,97 @@ def load_semantic_json_files(loan_id: str) -> list[dict]:
     
     print(f"\n📂 Loading {len(json_files)} semantic JSON files...")
     
+    # Reads release the GIL, so overlap them on a thread pool (results keep file order)
     documents = []
-    for json_file in json_files:
-        try:
-            with open(json_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # Include filename for reference
-                data['source_filename'] = json_file.name
-                data['source_path'] = str(json_file)
+    with ThreadPoolExecutor(max_workers=min(MAX_READ_WORKERS, len(json_files))) as executor:
+        for json_file, data in zip(json_files, executor.map(_load_one, json_files)):
+            if isinstance(data, Exception):
+                print(f"   ✗ Error loading {json_file.name}: {data}")
+            else:
                 documents.append(data)
-        except Exception as e:
-            print(f"   ✗ Error loading {json_file.name}: {e}")
     
     print(f"✓ Loaded {len(documents)} semantic documents")
     return documents
 
 
+@functools.lru_cache(maxsize=4096)
+def _parse_date(date_str: str, kind: str) -> Optional[datetime]:
+    """Parse a matched date string (memoized: loans repeat the same dates a lot)."""
+    # The regex already fixed the shape, so skip strptime's format parsing
+    try:
+        if kind == 'iso':
+            date = datetime.fromisoformat(date_str)
+        else:
+            month, day, year = date_str.split(_DATE_SEPARATORS[kind])
+            date = datetime(int(year), int(month), int(day))
+    except ValueError:
+        return None
+    return date if 2020 <= date.year <= 2030 else None  # Reasonable year range
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_iso_date(date_str: str) -> Optional[datetime]:
+    """Parse an ISO date/timestamp from key_dates (memoized)."""
+    try:
+        return datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
+
 def extract_dates_from_text(text: str) -> list[datetime]:
     """Extract potential dates from text content."""
     dates = []
+    text = str(text)
+    if not _HAS_DIGIT(text):
+        return dates
     
-    # Common date patterns
-    patterns = [
-        r'\b\d{1,2}/\d{1,2}/\d{4}\b',  # MM/DD/YYYY
-        r'\b\d{4}-\d{2}-\d{2}\b',      # YYYY-MM-DD
-        r'\b\d{1,2}-\d{1,2}-\d{4}\b',  # MM-DD-YYYY
-    ]
-    
-    for pattern in patterns:
-        matches = re.findall(pattern, str(text))
-        for match in matches:
-            try:
-                # Try different date formats
-                for fmt in ['%m/%d/%Y', '%Y-%m-%d', '%m-%d-%Y']:
-                    try:
-                        date = datetime.strptime(match, fmt)
-                        if 2020 <= date.year <= 2030:  # Reasonable year range
-                            dates.append(date)
-                        break
-                    except ValueError:
-                        continue
-            except Exception:
-                continue
+    for match in _DATE_RE.finditer(text):
+        date = _parse_date(match.group(), match.lastgroup)
+        if date is not None:
+            dates.append(date)
     
     return dates
 
 
+def _combined_text(doc: dict) -> str:
+    """Lowercased type, summary, entities and filename of a document (cached on the doc)."""
+    text = doc.get('_combined_lc')
+    if text is None:
+        doc_type = doc.get('document_type', '').lower()
+        summary = doc.get('summary', '').lower()
+        entities = doc.get('key_entities') or []
+        if isinstance(entities, list):
+            # Plain join: no list repr brackets/quotes to allocate or match against
+            entities = ' '.join(e if isinstance(e, str) else str(e) for e in entities)
+        key_entities = str(entities).lower()
+        filename = doc.get('source_filename', '').lower()
+        text = doc['_combined_lc'] = f"{doc_type} {summary} {key_entities} {filename}"
+    return text
+
+
 def categorize_document(doc: dict) -> str:
     """Categorize a document based on its content."""
-    # Get document content for analysis
-    doc_type = doc.get('document_type', '').lower()
-    summary = doc.get('summary', '').lower()
-    key_entities = str(doc.get('key_entities', [])).lower()
-    filename = doc.get('source_filename', '').lower()
-    
-    # Combine all text for keyword matching
-    combined_text = f"{doc_type} {summary} {key_entities} {filename}"
+    # All text for keyword matching
+    combined_text = _combined_text(doc)
     
-    # Check each category
-    best_match = "OTHER"
+    # Check each category (ties keep the earlier category; no hits means OTHER)
+    best_index = None
     best_score = 0
     
-    for category, info in DOCUMENT_CATEGORIES.items():
-        score = 0
-        for keyword in info['keywords']:
-            if keyword.lower() in combined_text:
-                score += 1
+    for index, keywords in enumerate(_CATEGORY_KEYWORDS):
+        score = sum(keyword in combined_text for keyword in keywords)
         
         if score > best_score:
             best_score = score
-            best_match = category
+            best_index = index
+            if best_score >= _REMAINING_MAX_SCORE[index]:
+                break
     
-    return best_match
+    return "OTHER" if best_index is None else _CATEGORY_NAMES[best_index]
 
 
-def analyze_timeline_with_llm(loan_id: str, documents: list[dict]) -> dict:
-    """Use LLM to analyze document timeline and extract key dates."""
-    
-    client = AzureOpenAI(
-        azure_endpoint=AZURE_OPENAI_ENDPOINT,
-        api_key=AZURE_OPENAI_API_KEY,
-        api_version=AZURE_OPENAI_API_VERSION
-    )
-    
-    system_prompt = """You are an expert mortgage loan processor and document analyst.
+# Prompts for analyze_timeline_with_llm
+TIMELINE_SYSTEM_PROMPT = """You are an expert mortgage loan processor and document analyst.
 
 Your task is to analyze loan documents and reconstruct the chronological timeline of the loan process.
 
@@ -306,28 +369,16 @@ Extract all dates mentioned in documents, including:
 
 Return detailed timeline analysis with accurate dates extracted from document content."""
 
-    # Prepare document summary for LLM
-    doc_summaries = []
-    for i, doc in enumerate(documents[:50]):  # Limit to first 50 to avoid token limits
-        doc_summary = {
-            "index": i,
-            "filename": doc.get('source_filename', 'unknown'),
-            "document_type": doc.get('document_type', 'unknown'),
-            "summary": doc.get('summary', 'No summary'),
-            "key_entities": doc.get('key_entities', [])[:10],  # Limit entities
-            "dates_found": doc.get('key_dates', [])
-        }
-        doc_summaries.append(doc_summary)
-    
-    user_prompt = f"""Analyze the loan document timeline for loan {loan_id}.
+# Static user prompt; only the loan ID, documents and date are filled per call
+TIMELINE_USER_PROMPT = """Analyze the loan document timeline for loan {loan_id}.
 
 Documents to analyze:
-{json.dumps(doc_summaries, indent=2)}
+{documents}
 
 Return a JSON object with this structure:
 {{
   "loan_id": "{loan_id}",
-  "analysis_date": "{datetime.now().strftime('%Y-%m-%d')}",
+  "analysis_date": "{analysis_date}",
   "key_milestones": [
     {{
       "milestone": "Application Submitted",
@@ -375,27 +426,57 @@ Return a JSON object with this structure:
   ]
 }}"""
 
+
+def analyze_timeline_with_llm(loan_id: str, documents: list[dict], run_time: Optional[datetime] = None) -> dict:
+    """Use LLM to analyze document timeline and extract key dates."""
+    run_time = run_time or datetime.now()
+    
+    client = AzureOpenAI(
+        azure_endpoint=AZURE_OPENAI_ENDPOINT,
+        api_key=AZURE_OPENAI_API_KEY,
+        api_version=AZURE_OPENAI_API_VERSION
+    )
+    
+    # Prepare document summary for LLM
+    doc_summaries = []
+    for i, doc in enumerate(documents[:50]):  # Limit to first 50 to avoid token limits
+        doc_summary = {
+            "index": i,
+            "filename": doc.get('source_filename', 'unknown'),
+            "document_type": doc.get('document_type', 'unknown'),
+            "summary": doc.get('summary', 'No summary'),
+            "key_entities": doc.get('key_entities', [])[:10],  # Limit entities
+            "dates_found": doc.get('key_dates', [])
+        }
+        doc_summaries.append(doc_summary)
+    
+    user_prompt = TIMELINE_USER_PROMPT.format(
+        loan_id=loan_id,
+        documents=orjson.dumps(doc_summaries).decode(),
+        analysis_date=run_time.strftime('%Y-%m-%d')
+    )
+
     print(f"\n🤖 Analyzing document timeline with Azure OpenAI ({AZURE_OPENAI_DEPLOYMENT})...")
     
     try:
         response = client.chat.completions.create(
             model=AZURE_OPENAI_DEPLOYMENT,
             messages=[
-                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": TIMELINE_SYSTEM_PROMPT},
                 {"role": "user", "content": user_prompt}
             ],
             response_format={"type": "json_object"},
             max_completion_tokens=16000
         )
         
-        analysis = json.loads(response.choices[0].message.content)
+        analysis = orjson.loads(response.choices[0].message.content)
         
         # Add metadata
         analysis['metadata'] = {
             'agent': 'document_timeline_agent',
             'version': '1.0',
             'model': AZURE_OPENAI_DEPLOYMENT,
-            'analysis_timestamp': datetime.now().isoformat(),
+            'analysis_timestamp': run_time.isoformat(),
             'total_documents_analyzed': len(documents)
         }
         
@@ -422,11 +503,9 @@ def organize_documents_locally(documents: list[dict]) -> dict:
             for date_item in doc['key_dates']:
                 if isinstance(date_item, str):
                     # Try to parse string dates
-                    try:
-                        parsed_date = datetime.fromisoformat(date_item.replace('Z', '+00:00'))
+                    parsed_date = _parse_iso_date(date_item)
+                    if parsed_date is not None:
                         dates.append(parsed_date)
-                    except:
-                        pass
                 elif isinstance(date_item, datetime):
                     dates.append(date_item)
         
@@ -449,78 +528,86 @@ def organize_documents_locally(documents: list[dict]) -> dict:
     return dict(organized)
 
 
-def save_timeline_report(loan_id: str, analysis: dict, organized: dict) -> str:
+def save_timeline_report(loan_id: str, analysis: dict, organized: dict, run_time: Optional[datetime] = None) -> str:
     """Save the timeline analysis report."""
+    run_time = run_time or datetime.now()
     reports_dir = Path(f"loan_docs/{loan_id}/reports")
     reports_dir.mkdir(parents=True, exist_ok=True)
     
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    timestamp = run_time.strftime("%Y%m%d_%H%M%S")
     
     # Save full analysis
     analysis_path = reports_dir / f"document_timeline_{loan_id}_{timestamp}.json"
-    with open(analysis_path, 'w', encoding='utf-8') as f:
-        json.dump({
-            'llm_analysis': analysis,
-            'local_categorization': organized
-        }, f, indent=2)
+    analysis_path.write_bytes(orjson.dumps({
+        'llm_analysis': analysis,
+        'local_categorization': organized
+    }, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
     
-    # Save human-readable summary
+    # Save human-readable summary (built in memory, written once)
     summary_path = reports_dir / f"document_timeline_{loan_id}_{timestamp}.md"
-    with open(summary_path, 'w', encoding='utf-8') as f:
-        f.write(f"# Document Timeline Analysis - Loan {loan_id}\n\n")
-        f.write(f"**Analysis Date:** {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-        
-        # Timeline summary
-        if analysis.get('timeline_summary'):
-            f.write("## Timeline Summary\n\n")
-            summary = analysis['timeline_summary']
-            for key, value in summary.items():
-                label = key.replace('_', ' ').title()
-                f.write(f"- **{label}:** {value}\n")
-            f.write("\n")
-        
-        # Key milestones
-        if analysis.get('key_milestones'):
-            f.write("## Key Milestones\n\n")
-            for milestone in analysis['key_milestones']:
-                f.write(f"### {milestone.get('milestone')}\n")
-                f.write(f"- **Date:** {milestone.get('date')}\n")
-                f.write(f"- **Details:** {milestone.get('details')}\n")
-                if milestone.get('document_references'):
-                    f.write(f"- **Documents:** {', '.join(milestone['document_references'])}\n")
-                f.write("\n")
-        
-        # Documents by stage
-        if analysis.get('documents_by_stage'):
-            f.write("## Documents by Loan Stage\n\n")
-            for stage, docs in analysis['documents_by_stage'].items():
-                if docs:
-                    f.write(f"### {stage} ({len(docs)} documents)\n\n")
-                    for doc in docs:
-                        f.write(f"- **{doc.get('filename')}**\n")
-                        f.write(f"  - Type: {doc.get('document_type')}\n")
-                        if doc.get('key_date'):
-                            f.write(f"  - Date: {doc['key_date']}\n")
-                        if doc.get('description'):
-                            f.write(f"  - Description: {doc['description']}\n")
-                        f.write("\n")
-        
-        # Document gaps
-        if analysis.get('document_gaps'):
-            f.write("## Document Gaps / Missing Items\n\n")
-            for gap in analysis['document_gaps']:
-                f.write(f"- {gap}\n")
-            f.write("\n")
-        
-        # Processing notes
-        if analysis.get('processing_notes'):
-            f.write("## Processing Notes\n\n")
-            for note in analysis['processing_notes']:
-                f.write(f"- {note}\n")
+    parts = []
+    add = parts.append
+    add(f"# Document Timeline Analysis - Loan {loan_id}\n\n")
+    add(f"**Analysis Date:** {run_time.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+    
+    # Timeline summary
+    if analysis.get('timeline_summary'):
+        add("## Timeline Summary\n\n")
+        summary = analysis['timeline_summary']
+        for key, value in summary.items():
+            label = key.replace('_', ' ').title()
+            add(f"- **{label}:** {value}\n")
+        add("\n")
+    
+    # Key milestones
+    if analysis.get('key_milestones'):
+        add("## Key Milestones\n\n")
+        for milestone in analysis['key_milestones']:
+            add(f"### {milestone.get('milestone')}\n")
+            add(f"- **Date:** {milestone.get('date')}\n")
+            add(f"- **Details:** {milestone.get('details')}\n")
+            if milestone.get('document_references'):
+                add(f"- **Documents:** {', '.join(milestone['document_references'])}\n")
+            add("\n")
+    
+    # Documents by stage
+    if analysis.get('documents_by_stage'):
+        add("## Documents by Loan Stage\n\n")
+        for stage, docs in analysis['documents_by_stage'].items():
+            if docs:
+                add(f"### {stage} ({len(docs)} documents)\n\n")
+                for doc in docs:
+                    add(f"- **{doc.get('filename')}**\n")
+                    add(f"  - Type: {doc.get('document_type')}\n")
+                    if doc.get('key_date'):
+                        add(f"  - Date: {doc['key_date']}\n")
+                    if doc.get('description'):
+                        add(f"  - Description: {doc['description']}\n")
+                    add("\n")
+    
+    # Document gaps
+    if analysis.get('document_gaps'):
+        add("## Document Gaps / Missing Items\n\n")
+        for gap in analysis['document_gaps']:
+            add(f"- {gap}\n")
+        add("\n")
+    
+    # Processing notes
+    if analysis.get('processing_notes'):
+        add("## Processing Notes\n\n")
+        for note in analysis['processing_notes']:
+            add(f"- {note}\n")
+    
+    summary_path.write_text(''.join(parts), encoding='utf-8')
     
     return str(analysis_path)
 
 
+def _milestone_sort_key(milestone: dict) -> str:
+    """Sort milestones by date; undated (missing or null) ones go last."""
+    return milestone.get('date') or '9999-99-99'
+
+
 def display_timeline_summary(analysis: dict, organized: dict):
     """Display formatted timeline summary."""
     print("\n" + "="*80)
@@ -555,8 +642,7 @@ def display_timeline_summary(analysis: dict, organized: dict):
     if analysis.get('key_milestones'):
         print("\n\n🎯 KEY MILESTONES")
         print("-" * 80)
-        for milestone in sorted(analysis['key_milestones'], 
-                               key=lambda x: x.get('date', '9999-99-99')):
+        for milestone in sorted(analysis['key_milestones'], key=_milestone_sort_key):
             date = milestone.get('date', 'Unknown')
             name = milestone.get('milestone', 'Unknown')
             details = milestone.get('details', '')
@@ -569,12 +655,10 @@ def display_timeline_summary(analysis: dict, organized: dict):
     print("\n\n📚 DOCUMENTS BY LOAN STAGE")
     print("-" * 80)
     
-    if analysis.get('documents_by_stage'):
-        for stage in ["Application", "Credit Pull", "Home Valuation", 
-                      "Income Verification", "Asset Verification", 
-                      "Additional Documentation", "Underwriting Decision",
-                      "Pre-Closing", "Closing", "Funding"]:
-            docs = analysis['documents_by_stage'].get(stage, [])
+    documents_by_stage = analysis.get('documents_by_stage')
+    if documents_by_stage:
+        for stage in _STAGE_ORDER:
+            docs = documents_by_stage.get(stage)
             if docs:
                 print(f"\n   {stage.upper()} ({len(docs)} documents)")
                 for doc in docs[:5]:  # Show first 5
@@ -592,7 +676,7 @@ def display_timeline_summary(analysis: dict, organized: dict):
     # Sort categories by priority
     sorted_categories = sorted(
         organized.items(),
-        key=lambda x: DOCUMENT_CATEGORIES[x[0]]['priority']
+        key=lambda x: _CATEGORY_PRIORITY[x[0]]
     )
     
     for category, docs in sorted_categories:
@@ -633,6 +717,8 @@ def main():
         sys.exit(1)
     
     loan_id = sys.argv[1]
+    # One timestamp for every artifact of this run
+    run_time = datetime.now()
     
     print(f"\n🚀 Starting Document Timeline Agent for Loan {loan_id}")
     print("="*80)
@@ -651,7 +737,7 @@ def main():
     
     # Analyze timeline with LLM (detailed analysis)
     try:
-        analysis = analyze_timeline_with_llm(loan_id, documents)
+        analysis = analyze_timeline_with_llm(loan_id, documents, run_time)
         print("✓ Timeline analysis completed")
     except Exception as e:
         print(f"❌ Failed to analyze timeline: {e}")
@@ -659,7 +745,7 @@ def main():
     
     # Save reports
     try:
-        report_path = save_timeline_report(loan_id, analysis, organized)
+        report_path = save_timeline_report(loan_id, analysis, organized, run_time)
         print(f"✓ Timeline report saved to: {report_path}")
     except Exception as e:
         print(f"❌ Failed to save report: {e}")
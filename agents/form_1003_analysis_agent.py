@@ -1,24 +1,49 @@
 """
-Form 1003 Analysis Agent (Two-Turn Process)
+Form 1003 Analysis Agent
 
 The Form 1003 (Uniform Residential Loan Application) is the ANCHOR of the underwriting process.
 Everything else in the loan file exists to VALIDATE what the borrowers declared on the 1003.
 
-Turn 1: Identify all JSON files that contain 1003 data or related pages
-Turn 2: Extract all borrower assertions from the 1003 that require validation
+A single LLM call does both steps and returns them in one JSON response:
+1. Identify all JSON files that contain 1003 data or related pages
+2. Extract all borrower assertions from the 1003 that require validation
+
+Only files recognizable as the 1003 by name or document type are sent; when
+none are, a first, summary-only call picks them.
 
 Validation categories:
 - PULLED DATA: Credit reports, property appraisals, title reports, VOE
 - SUBMITTED DOCUMENTS: Paystubs, W-2s, bank statements, tax returns, insurance
+
+Usage:
+    python agents/form_1003_analysis_agent.py [--no-cache] [--pretty] [<loan_id> ...]
+    python agents/form_1003_analysis_agent.py --batch [--pretty] <loan_id> [<loan_id> ...]
+
+Without --batch, up to 10 loans are analyzed concurrently (each loan's progress
+messages only with VERBOSE=1, its results always), and a loan whose
+request is unchanged since a previous run reuses that run's response
+(cached under loan_docs/_cache/form_1003/); --no-cache always calls the LLM.
+--batch submits all loans as one Azure OpenAI Batch job (24h completion
+window, roughly half the token cost) and waits for the results.
+Reports are saved as compact JSON; --pretty indents them.
 """
 
 import json
+import orjson
 import os
+import sys
+import random
+import asyncio
+import tempfile
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, List, Any
-from openai import AzureOpenAI
+from typing import Dict, List, Tuple, Any
+from openai import AsyncAzureOpenAI, RateLimitError, APITimeoutError, APIConnectionError, InternalServerError
 from dotenv import load_dotenv
+from _loan_io import (
+    load_all_loan_json_files, save_1003_analysis, identify_1003_files_heuristic,
+    response_cache_key, load_cached_response, save_cached_response
+)
 
 load_dotenv()
 
@@ -27,152 +52,151 @@ deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT")
 subscription_key = os.getenv("AZURE_OPENAI_KEY")
 api_version = os.getenv("AZURE_OPENAI_API_VERSION")
 
-client = AzureOpenAI(
-    api_key=subscription_key,
-    api_version=api_version,
-    azure_endpoint=endpoint
-)
+# Shared Azure OpenAI client, created on first use so importing this module
+# (e.g. to dispatch to it) doesn't build a client or need credentials
+_client = None
+
+def get_client():
+    """Return the shared Azure OpenAI client, creating it on first use."""
+    global _client
+    if _client is None:
+        _client = AsyncAzureOpenAI(
+            api_key=subscription_key,
+            api_version=api_version,
+            azure_endpoint=endpoint
+        )
+    return _client
 
 DEPLOYMENT_NAME = deployment
 
-
-def load_all_loan_json_files(loan_id: str) -> Dict[str, Dict]:
-    """Load all JSON files for a given loan."""
-    json_dir = Path(f"loan_docs/{loan_id}/json")
-    
-    if not json_dir.exists():
-        print(f"JSON directory not found: {json_dir}")
-        return {}
-    
-    json_files = {}
-    for json_file in json_dir.glob("*.json"):
+MAX_CONCURRENT_LOANS = 10
+# Per-loan progress output during multi-loan runs (VERBOSE=1 to enable)
+VERBOSE = os.getenv("VERBOSE") == "1"
+MAX_RETRIES = 3
+MAX_COMPLETION_TOKENS = 16000
+# Prompts longer than the model context (minus room for the output) would
+# fail only after a full round trip; ~4 characters per token
+MODEL_CONTEXT_TOKENS = int(os.getenv("MODEL_CONTEXT_TOKENS", "128000"))
+MAX_PROMPT_CHARS = (MODEL_CONTEXT_TOKENS - MAX_COMPLETION_TOKENS) * 4
+# Greedy, seeded decoding: extraction wants the same answer for the same request
+TEMPERATURE = 0
+SEED = 42
+
+
+async def create_completion(**kwargs):
+    """Call chat completions, retrying rate limits and server errors with exponential backoff."""
+    for attempt in range(MAX_RETRIES + 1):
         try:
-            with open(json_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                json_files[json_file.stem] = data
-        except Exception as e:
-            print(f"Error loading {json_file.name}: {e}")
-    
-    return json_files
+            return await get_client().chat.completions.create(**kwargs)
+        except (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError) as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = min(2 ** attempt + random.random(), 60)
+            print(f"⚠️  {type(e).__name__}, retrying in {delay:.1f}s...")
+            await asyncio.sleep(delay)
 
 
-def turn1_identify_1003_files(loan_id: str, json_data: Dict[str, Dict]) -> List[str]:
+async def select_1003_candidates(json_data: Dict[str, Dict], use_cache: bool = True, verbose: bool = True) -> Dict[str, Dict]:
     """
-    TURN 1: Identify all JSON files that contain Form 1003 data.
+    Narrow the loan package to its Form 1003 files.
     
-    The 1003 may be split across multiple files (pages) or have related documents.
+    Most 1003s are found by name or document type without an LLM call. When
+    none match, the LLM picks them from the one-line file summary (not the
+    files' full data). Either way only those files are sent for extraction.
     """
+    candidates = identify_1003_files_heuristic(json_data)
+    if candidates:
+        if verbose:
+            print(f"Recognized {len(candidates)} Form 1003 file(s) by name or document type; sending only those")
+    else:
+        if verbose:
+            print("No Form 1003 files recognized by name or document type; identifying them from the file summary")
+        candidates = await identify_1003_files_llm(json_data, use_cache)
+        if verbose:
+            print(f"Identified {len(candidates)} Form 1003 file(s) from the file summary")
+    return {filename: json_data[filename] for filename in candidates}
+
+
+async def identify_1003_files_llm(json_data: Dict[str, Dict], use_cache: bool = True) -> List[str]:
+    """
+    Ask the LLM which files are the Form 1003, from the file summary only.
     
-    print(f"\n{'='*80}")
-    print("TURN 1: Identifying Form 1003 Documents")
-    print(f"{'='*80}\n")
-    
-    # Create a summary of all files for the agent
-    file_summary = {}
-    for filename, data in json_data.items():
-        doc_type = data.get('document_type', 'Unknown')
-        # Get a preview of the content
-        preview = {
-            'document_type': doc_type,
-            'keys': list(data.keys())[:20],  # First 20 keys
-            'sample_data': {}
+    Returns the identified filenames that are in the package; an identical
+    request made before reuses the cached response unless use_cache is False.
+    """
+    messages = [
+        {
+            "role": "system",
+            "content": IDENTIFY_1003_SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": f"""Here is a summary of all {len(json_data)} JSON files in the loan package, one line per file (filename, document type, first keys, sample fields):
+
+{summarize_loan_files(json_data)}
+"""
         }
-        
-        # Add some sample fields
-        for key in ['application_date', 'borrower_name', 'loan_amount', 'property_address']:
-            if key in data:
-                preview['sample_data'][key] = data[key]
-        
-        file_summary[filename] = preview
+    ]
+    request = {
+        "model": DEPLOYMENT_NAME,
+        "messages": messages,
+        "response_format": {"type": "json_object"},
+        "temperature": TEMPERATURE,
+        "seed": SEED
+    }
+    cache_key = response_cache_key(request)
+    content = load_cached_response(cache_key) if use_cache else None
     
-    # Create prompt for agent
-    prompt = f"""You are analyzing a mortgage loan file to identify all documents related to the Form 1003 (Uniform Residential Loan Application).
+    try:
+        if content is None:
+            response = await create_completion(**request)
+            content = response.choices[0].message.content
+        identified_files = [filename for filename in json.loads(content).get('1003_files', []) if filename in json_data]
+    except Exception as e:
+        print(f"Error identifying Form 1003 files: {e}")
+        return []
+    
+    if identified_files and use_cache:
+        save_cached_response(cache_key, content)
+    return identified_files
 
-The Form 1003 is THE ANCHOR DOCUMENT for mortgage underwriting. It is the standard industry-wide application form where borrowers declare:
-- Personal information (names, SSNs, DOBs, contact info)
-- Employment and income
-- Assets and liabilities
-- Property information
-- Loan details and purpose
-- Declarations about their financial situation
+
+# Instructions for the summary-only identification call, made when no file is
+# recognizably the 1003
+IDENTIFY_1003_SYSTEM_PROMPT = """You are an expert mortgage document analyst. You identify Form 1003 documents with high accuracy.
+
+You are analyzing the mortgage loan file summarized by the user to identify all documents related to the Form 1003 (Uniform Residential Loan Application).
 
 The 1003 may be:
 1. A single multi-page document split into multiple JSON files (form_1003_pg1.json, form_1003_pg2.json, etc.)
 2. An electronic application (eApp, e1003, application.json)
 3. Listed as "Uniform Residential Loan Application" or "URLA"
 
-Here is a summary of all {len(json_data)} JSON files in the loan package:
-
-{json.dumps(file_summary, indent=2)}
-
-Your task:
 Identify ALL filenames that contain Form 1003 data or are pages of the 1003.
+Only include files that are actually the 1003 or parts of it. Do NOT include validation documents like credit reports, paystubs, or appraisals.
 
 Return your response as a JSON array of filenames, like this:
-{{"1003_files": ["form_1003_pg1", "form_1003_pg2", "application", "urla"]}}
+{"1003_files": ["form_1003_pg1", "form_1003_pg2", "application", "urla"]}"""
 
-Only include files that are actually the 1003 or parts of it. Do NOT include validation documents like credit reports, paystubs, or appraisals.
-"""
-    
-    print("Calling Azure OpenAI to identify 1003 files...")
-    
-    try:
-        response = client.chat.completions.create(
-            model=DEPLOYMENT_NAME,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert mortgage document analyst. You identify Form 1003 documents with high accuracy."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            response_format={"type": "json_object"}
-        )
-        
-        result = json.loads(response.choices[0].message.content)
-        identified_files = result.get('1003_files', [])
-        
-        print(f"\n✅ Identified {len(identified_files)} Form 1003 file(s):")
-        for filename in identified_files:
-            print(f"   - {filename}")
-        
-        return identified_files
-        
-    except Exception as e:
-        print(f"Error in Turn 1: {e}")
-        return []
 
+# Static instructions: identical on every call, so they lead the request
+# (system message) where the service can cache the prompt prefix
+FORM_1003_SYSTEM_PROMPT = """You are an expert mortgage underwriter. You identify Form 1003 documents with high accuracy and extract comprehensive borrower assertions from them with perfect accuracy and completeness.
 
-def turn2_extract_1003_assertions(loan_id: str, json_data: Dict[str, Dict], form_1003_files: List[str]) -> Dict:
-    """
-    TURN 2: Extract all borrower assertions from the 1003 that require validation.
-    
-    These assertions fall into two categories:
-    1. PULLED DATA - Lender pulls data to verify (credit, appraisal, VOE, title)
-    2. SUBMITTED DOCUMENTS - Borrower provides documentation (paystubs, W-2s, bank statements)
-    """
-    
-    print(f"\n{'='*80}")
-    print("TURN 2: Extracting Form 1003 Assertions")
-    print(f"{'='*80}\n")
-    
-    # Combine all 1003 data
-    combined_1003_data = {}
-    for filename in form_1003_files:
-        if filename in json_data:
-            combined_1003_data[filename] = json_data[filename]
-    
-    if not combined_1003_data:
-        print("❌ No 1003 data found!")
-        return {}
-    
-    # Create prompt for extraction
-    prompt = f"""You are analyzing the Form 1003 (Uniform Residential Loan Application) to extract ALL borrower assertions that require validation.
+You are analyzing the mortgage loan file provided by the user to identify all documents related to the Form 1003 (Uniform Residential Loan Application) and to extract ALL borrower assertions from it that require validation.
 
-The Form 1003 is THE STARTING POINT of the underwriting process. The borrowers signed this form on a specific date, making declarations about their financial situation, employment, income, assets, debts, and the property they want to finance.
+The Form 1003 is THE ANCHOR DOCUMENT for mortgage underwriting and THE STARTING POINT of the underwriting process. It is the standard industry-wide application form. The borrowers signed this form on a specific date, declaring:
+- Personal information (names, SSNs, DOBs, contact info)
+- Employment and income
+- Assets and liabilities
+- Property information
+- Loan details and purpose
+- Declarations about their financial situation
+
+The 1003 may be:
+1. A single multi-page document split into multiple JSON files (form_1003_pg1.json, form_1003_pg2.json, etc.)
+2. An electronic application (eApp, e1003, application.json)
+3. Listed as "Uniform Residential Loan Application" or "URLA"
 
 EVERYTHING ELSE in the loan file exists to VALIDATE these assertions through either:
 
@@ -191,11 +215,12 @@ EVERYTHING ELSE in the loan file exists to VALIDATE these assertions through eit
    - Insurance declarations (validate property insurance)
    - Purchase agreement (validates transaction)
 
-Here is the complete Form 1003 data (may be across multiple pages):
+Your task has two steps.
 
-{json.dumps(combined_1003_data, indent=2)}
+STEP 1: Identify ALL filenames that contain Form 1003 data or are pages of the 1003.
+Only include files that are actually the 1003 or parts of it. Do NOT include validation documents like credit reports, paystubs, or appraisals.
 
-Your task is to extract a comprehensive JSON structure containing:
+STEP 2: From the Form 1003 files identified in step 1 ONLY, extract a comprehensive JSON structure containing:
 
 1. PROCESS ANCHOR:
    - application_date (when 1003 was signed - this is day 0 of the process)
@@ -248,83 +273,199 @@ Your task is to extract a comprehensive JSON structure containing:
       - Loan on property
       - Down payment borrowed
 
-Return a comprehensive JSON object with all extracted information clearly organized.
-Use this structure as a guide but include ALL data you find.
+Return a single JSON object with both results, like this:
+{"1003_files": ["form_1003_pg1", "form_1003_pg2", "application", "urla"], "assertions": {...}}
+
+"assertions" is a comprehensive JSON object with all extracted information clearly organized.
+Use the structure above as a guide but include ALL data you find in the 1003 files."""
+
+
+def summarize_loan_files(json_data: Dict[str, Dict]) -> str:
+    """
+    Summarize each file on one tab-separated line: an indented JSON preview
+    per file spends most of its tokens on structure.
+    """
+    summary_lines = []
+    for filename, data in json_data.items():
+        fields = [
+            filename,
+            f"document_type={data.get('document_type', 'Unknown')}",
+            f"keys={','.join(list(data.keys())[:20])}"  # First 20 keys
+        ]
+        
+        # Add some sample fields
+        for key in ['application_date', 'borrower_name', 'loan_amount', 'property_address']:
+            if key in data:
+                fields.append(f"{key}={orjson.dumps(data[key]).decode()}")
+        
+        summary_lines.append("\t".join(fields))
+    return "\n".join(summary_lines)
+
+
+def build_1003_messages(json_data: Dict[str, Dict]) -> List[Dict]:
+    """Build the chat messages that identify the 1003 files and extract their assertions."""
+    file_summary = summarize_loan_files(json_data)
+    
+    # Only the loan package varies between calls; it follows the static instructions
+    prompt = f"""Here is a summary of all {len(json_data)} JSON files in the loan package, one line per file (filename, document type, first keys, sample fields):
+
+{file_summary}
+
+Here is the complete data of every JSON file in the loan package, keyed by filename:
+
+{orjson.dumps(json_data).decode()}
 """
     
-    print("Calling Azure OpenAI to extract 1003 assertions...")
-    print("This may take a moment due to the comprehensive analysis required...\n")
+    return [
+        {
+            "role": "system",
+            "content": FORM_1003_SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": prompt
+        }
+    ]
+
+
+def prompt_chars(messages: List[Dict]) -> int:
+    """Total characters of the chat messages' content."""
+    return sum(len(message['content']) for message in messages)
+
+
+def parse_1003_response(content: str) -> Tuple[List[str], Dict]:
+    """Split the model's JSON response into (form_1003_files, assertions)."""
+    result = json.loads(content)
+    return result.get('1003_files', []), result.get('assertions', {})
+
+
+async def identify_and_extract_1003(loan_id: str, json_data: Dict[str, Dict], use_cache: bool = True, verbose: bool = True) -> Tuple[List[str], Dict]:
+    """
+    Identify the Form 1003 files and extract their borrower assertions in one call
+    (preceded by a summary-only identification call when no file is
+    recognizably the 1003).
+    
+    The 1003 may be split across multiple files (pages) or have related documents.
+    The assertions fall into two categories:
+    1. PULLED DATA - Lender pulls data to verify (credit, appraisal, VOE, title)
+    2. SUBMITTED DOCUMENTS - Borrower provides documentation (paystubs, W-2s, bank statements)
+    
+    An identical request (same model, messages and parameters) made before reuses the cached
+    response unless use_cache is False. verbose=False prints only the results,
+    as one block, so concurrent loans don't interleave.
+    
+    Returns (form_1003_files, assertions); both are empty if the call fails,
+    and assertions is empty if the 1003 files don't fit the model context.
+    """
+    
+    if verbose:
+        print(f"\n{'='*80}")
+        print("Identifying Form 1003 Documents and Extracting Assertions")
+        print(f"{'='*80}\n")
+    
+    candidates = await select_1003_candidates(json_data, use_cache, verbose)
+    if not candidates:
+        return [], {}
+    
+    # A prompt past the model context would fail only after a full round trip
+    messages = build_1003_messages(candidates)
+    if prompt_chars(messages) > MAX_PROMPT_CHARS:
+        print(f"❌ Form 1003 documents for loan {loan_id} don't fit the model context (~{prompt_chars(messages) // 4} tokens)")
+        return list(candidates), {}
+    
+    request = {
+        "model": DEPLOYMENT_NAME,
+        "messages": messages,
+        "response_format": {"type": "json_object"},
+        "max_completion_tokens": MAX_COMPLETION_TOKENS,
+        "temperature": TEMPERATURE,
+        "seed": SEED
+    }
+    cache_key = response_cache_key(request)
+    content = load_cached_response(cache_key) if use_cache else None
     
     try:
-        response = client.chat.completions.create(
-            model=DEPLOYMENT_NAME,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert mortgage underwriter. You extract comprehensive borrower assertions from Form 1003 applications with perfect accuracy and completeness."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            response_format={"type": "json_object"},
-            max_completion_tokens=16000
-        )
-        
-        assertions = json.loads(response.choices[0].message.content)
-        
-        print(f"\n✅ Successfully extracted Form 1003 assertions!")
-        
-        # Print summary
-        if 'process_anchor' in assertions:
-            anchor = assertions['process_anchor']
-            print(f"\n📌 PROCESS ANCHOR:")
-            print(f"   Application Date: {anchor.get('application_date', 'Not found')}")
-            print(f"   This is DAY 0 of the underwriting process")
-        
-        if 'borrower_information' in assertions:
-            print(f"\n👤 BORROWERS:")
-            borrowers = assertions['borrower_information']
-            if 'primary_borrower' in borrowers:
-                print(f"   Primary: {borrowers['primary_borrower'].get('name', 'Unknown')}")
-            if 'co_borrower' in borrowers:
-                print(f"   Co-borrower: {borrowers['co_borrower'].get('name', 'Unknown')}")
-        
-        if 'employment_and_income' in assertions:
-            print(f"\n💼 EMPLOYMENT & INCOME (requires validation via paystubs, W-2s, VOE)")
-            emp = assertions['employment_and_income']
-            for borrower_key in emp:
-                if isinstance(emp[borrower_key], dict):
-                    employer = emp[borrower_key].get('employer_name', 'Unknown')
-                    income = emp[borrower_key].get('monthly_income', {})
-                    print(f"   {borrower_key}: {employer}")
-        
-        if 'liabilities' in assertions:
-            print(f"\n💳 LIABILITIES (requires validation via credit report)")
-            liabs = assertions['liabilities']
-            total_liabs = len(liabs) if isinstance(liabs, list) else len(liabs.keys()) if isinstance(liabs, dict) else 0
-            print(f"   {total_liabs} liabilities declared")
+        if content is not None:
+            if verbose:
+                print("♻️  Cache hit for identical request, skipped LLM call")
+        else:
+            if verbose:
+                print("Calling Azure OpenAI to identify 1003 files and extract assertions...")
+                print("This may take a moment due to the comprehensive analysis required...\n")
+            
+            response = await create_completion(**request)
+            content = response.choices[0].message.content
         
-        if 'property_information' in assertions:
-            print(f"\n🏠 PROPERTY (requires validation via appraisal, title)")
-            prop = assertions['property_information']
-            addr = prop.get('property_address', 'Unknown')
-            value = prop.get('estimated_value', 'Unknown')
-            print(f"   Address: {addr}")
-            print(f"   Estimated Value: {value}")
-        
-        return assertions
+        identified_files, assertions = parse_1003_response(content)
         
     except Exception as e:
-        print(f"Error in Turn 2: {e}")
-        return {}
-
-
-def save_1003_analysis(loan_id: str, form_1003_files: List[str], assertions: Dict):
-    """Save the analysis to a JSON file for downstream processing."""
-    
-    output = {
+        print(f"Error analyzing Form 1003 for loan {loan_id}: {e}")
+        return [], {}
+    
+    # Cache only responses that parsed and carry assertions
+    if assertions and use_cache:
+        save_cached_response(cache_key, content)
+    
+    # Results are built up, then written once
+    lines = [] if verbose else ["", "=" * 80, f"FORM 1003 - Loan {loan_id}", "=" * 80]
+    lines.append(f"\n✅ Identified {len(identified_files)} Form 1003 file(s):")
+    lines.extend(f"   - {filename}" for filename in identified_files)
+    
+    if assertions:
+        lines.append(f"\n✅ Successfully extracted Form 1003 assertions!")
+        lines.extend(format_assertions_summary(assertions))
+    sys.stdout.write("\n".join(lines) + "\n")
+    
+    return identified_files, assertions
+
+
+def format_assertions_summary(assertions: Dict) -> List[str]:
+    """Summarize the headline Form 1003 assertions and what validates each of them."""
+    lines = []
+    
+    if 'process_anchor' in assertions:
+        anchor = assertions['process_anchor']
+        lines.append(f"\n📌 PROCESS ANCHOR:")
+        lines.append(f"   Application Date: {anchor.get('application_date', 'Not found')}")
+        lines.append(f"   This is DAY 0 of the underwriting process")
+    
+    if 'borrower_information' in assertions:
+        lines.append(f"\n👤 BORROWERS:")
+        borrowers = assertions['borrower_information']
+        if 'primary_borrower' in borrowers:
+            lines.append(f"   Primary: {borrowers['primary_borrower'].get('name', 'Unknown')}")
+        if 'co_borrower' in borrowers:
+            lines.append(f"   Co-borrower: {borrowers['co_borrower'].get('name', 'Unknown')}")
+    
+    if 'employment_and_income' in assertions:
+        lines.append(f"\n💼 EMPLOYMENT & INCOME (requires validation via paystubs, W-2s, VOE)")
+        emp = assertions['employment_and_income']
+        for borrower_key in emp:
+            if isinstance(emp[borrower_key], dict):
+                employer = emp[borrower_key].get('employer_name', 'Unknown')
+                income = emp[borrower_key].get('monthly_income', {})
+                lines.append(f"   {borrower_key}: {employer}")
+    
+    if 'liabilities' in assertions:
+        lines.append(f"\n💳 LIABILITIES (requires validation via credit report)")
+        liabs = assertions['liabilities']
+        total_liabs = len(liabs) if isinstance(liabs, list) else len(liabs.keys()) if isinstance(liabs, dict) else 0
+        lines.append(f"   {total_liabs} liabilities declared")
+    
+    if 'property_information' in assertions:
+        lines.append(f"\n🏠 PROPERTY (requires validation via appraisal, title)")
+        prop = assertions['property_information']
+        addr = prop.get('property_address', 'Unknown')
+        value = prop.get('estimated_value', 'Unknown')
+        lines.append(f"   Address: {addr}")
+        lines.append(f"   Estimated Value: {value}")
+    
+    return lines
+
+
+def build_1003_report(loan_id: str, form_1003_files: List[str], assertions: Dict) -> Dict:
+    """Wrap the extracted assertions with the metadata downstream agents expect."""
+    return {
         'loan_id': loan_id,
         'analysis_date': datetime.now().isoformat(),
         'form_1003_files': form_1003_files,
@@ -337,57 +478,49 @@ def save_1003_analysis(loan_id: str, form_1003_files: List[str], assertions: Dic
             }
         }
     }
-    
-    # Save to JSON in loan-specific reports folder
-    report_dir = Path(f"loan_docs/{loan_id}/reports")
-    report_dir.mkdir(parents=True, exist_ok=True)
-    
-    json_file = report_dir / "form_1003_analysis.json"
-    
-    with open(json_file, 'w', encoding='utf-8') as f:
-        json.dump(output, f, indent=2)
-    
-    print(f"\n{'='*80}")
-    print(f"📄 Analysis saved to: {json_file}")
-    print(f"{'='*80}\n")
-    
-    return json_file
 
 
-def main():
-    loan_id = "1000182227"
+async def analyze_loan(loan_id: str, use_cache: bool = True, verbose: bool = True, pretty: bool = False):
+    """
+    Run the Form 1003 analysis for one loan and save its report.
     
-    print(f"\n{'='*80}")
-    print("FORM 1003 ANALYSIS AGENT")
-    print("Two-Turn Process to Identify and Extract Borrower Assertions")
-    print(f"{'='*80}\n")
+    verbose=False skips the banners and progress messages, leaving the results
+    summary, errors and the saved report path.
+    """
     
-    # Load all JSON files
-    print(f"Loading loan documents for {loan_id}...")
-    json_data = load_all_loan_json_files(loan_id)
+    if verbose:
+        print(f"\n{'='*80}")
+        print("FORM 1003 ANALYSIS AGENT")
+        print("Identify the 1003 and Extract Borrower Assertions in One Call")
+        print(f"{'='*80}\n")
+        
+        # Load all JSON files
+        print(f"Loading loan documents for {loan_id}...")
+    json_data = await asyncio.to_thread(load_all_loan_json_files, loan_id)
     
     if not json_data:
-        print("❌ No JSON files found!")
+        print(f"❌ No JSON files found for loan {loan_id}!")
         return
     
-    print(f"✅ Loaded {len(json_data)} JSON documents\n")
+    if verbose:
+        print(f"✅ Loaded {len(json_data)} JSON documents\n")
     
-    # TURN 1: Identify 1003 files
-    form_1003_files = turn1_identify_1003_files(loan_id, json_data)
+    # Identify 1003 files and extract their assertions
+    form_1003_files, assertions = await identify_and_extract_1003(loan_id, json_data, use_cache, verbose)
     
     if not form_1003_files:
-        print("\n❌ No Form 1003 files identified!")
+        print(f"\n❌ No Form 1003 files identified for loan {loan_id}!")
         return
     
-    # TURN 2: Extract assertions
-    assertions = turn2_extract_1003_assertions(loan_id, json_data, form_1003_files)
-    
     if not assertions:
-        print("\n❌ Failed to extract assertions!")
+        print(f"\n❌ Failed to extract assertions for loan {loan_id}!")
         return
     
     # Save results
-    output_file = save_1003_analysis(loan_id, form_1003_files, assertions)
+    output_file = save_1003_analysis(loan_id, build_1003_report(loan_id, form_1003_files, assertions), pretty)
+    
+    if not verbose:
+        return
     
     print("\n" + "="*80)
     print("✅ FORM 1003 ANALYSIS COMPLETE")
@@ -403,5 +536,145 @@ def main():
     print("="*80 + "\n")
 
 
+async def submit_batch(loan_ids: List[str], pretty: bool = False) -> Dict[str, Dict]:
+    """
+    Analyze Form 1003 for many loans through the Azure OpenAI Batch API.
+    
+    Writes one JSONL request per loan (custom_id = loan_id), submits a single
+    batch job, polls with exponential backoff until it finishes, then saves
+    each result as that loan's form_1003_analysis.json.
+    """
+    
+    print(f"\n{'='*80}")
+    print(f"FORM 1003 ANALYSIS BATCH - {len(loan_ids)} loans")
+    print(f"{'='*80}\n")
+    
+    submitted = 0
+    with tempfile.NamedTemporaryFile('w', suffix='.jsonl', encoding='utf-8', delete=False) as f:
+        batch_input_path = Path(f.name)
+        for loan_id in loan_ids:
+            print(f"Loading loan documents for {loan_id}...")
+            json_data = load_all_loan_json_files(loan_id)
+            if not json_data:
+                print(f"❌ No JSON files found for {loan_id}, skipping")
+                continue
+            candidates = await select_1003_candidates(json_data)
+            if not candidates:
+                print(f"❌ No Form 1003 files identified for {loan_id}, skipping")
+                continue
+            messages = build_1003_messages(candidates)
+            if prompt_chars(messages) > MAX_PROMPT_CHARS:
+                print(f"❌ Form 1003 documents for {loan_id} don't fit the model context (~{prompt_chars(messages) // 4} tokens), skipping")
+                continue
+            request = {
+                "custom_id": loan_id,
+                "method": "POST",
+                "url": "/chat/completions",
+                "body": {
+                    "model": DEPLOYMENT_NAME,
+                    "messages": messages,
+                    "response_format": {"type": "json_object"},
+                    "max_completion_tokens": MAX_COMPLETION_TOKENS,
+                    "temperature": TEMPERATURE,
+                    "seed": SEED
+                }
+            }
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+            submitted += 1
+    
+    if not submitted:
+        batch_input_path.unlink()
+        print("❌ No loans to submit!")
+        return {}
+    
+    client = get_client()
+    try:
+        with open(batch_input_path, 'rb') as f:
+            batch_file = await client.files.create(file=f, purpose="batch")
+    finally:
+        batch_input_path.unlink()
+    
+    batch = await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/chat/completions",
+        completion_window="24h"
+    )
+    print(f"\n📤 Submitted batch {batch.id} ({submitted} requests)")
+    
+    # Poll with exponential backoff (30s doubling up to 10 minutes)
+    delay = 30
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        print(f"⏳ Batch status: {batch.status} - checking again in {delay}s")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 600)
+        batch = await client.batches.retrieve(batch.id)
+    
+    if batch.status != "completed":
+        print(f"❌ Batch {batch.id} finished with status: {batch.status}")
+        return {}
+    
+    # Successful requests are in the output file; requests the service
+    # rejected are only in the error file (same record format)
+    results = {}
+    output = "\n".join([
+        (await client.files.content(file_id)).text
+        for file_id in (batch.output_file_id, batch.error_file_id) if file_id
+    ])
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        record = orjson.loads(line)
+        loan_id = record['custom_id']
+        response = record.get('response') or {}
+        if record.get('error') or response.get('status_code') != 200:
+            print(f"❌ Loan {loan_id} failed: {record.get('error') or response.get('body')}")
+            continue
+        
+        try:
+            form_1003_files, assertions = parse_1003_response(response['body']['choices'][0]['message']['content'])
+        except Exception as e:
+            print(f"❌ Loan {loan_id}: could not parse response: {e}")
+            continue
+        if not form_1003_files or not assertions:
+            print(f"❌ Loan {loan_id}: no Form 1003 assertions extracted")
+            continue
+        
+        save_1003_analysis(loan_id, build_1003_report(loan_id, form_1003_files, assertions), pretty)
+        results[loan_id] = assertions
+    
+    print(f"✅ Batch complete: {len(results)}/{len(loan_ids)} loans analyzed")
+    return results
+
+
+async def analyze_loans(loan_ids: List[str], use_cache: bool = True, pretty: bool = False):
+    """
+    Analyze Form 1003 for many loans concurrently (at most MAX_CONCURRENT_LOANS in flight).
+    """
+    sem = asyncio.Semaphore(MAX_CONCURRENT_LOANS)
+    
+    async def analyze_one(loan_id):
+        async with sem:
+            try:
+                await analyze_loan(loan_id, use_cache, verbose=VERBOSE, pretty=pretty)
+            except Exception as e:
+                print(f"❌ Error analyzing loan {loan_id}: {e}")
+    
+    await asyncio.gather(*(analyze_one(loan_id) for loan_id in loan_ids))
+
+
+def main():
+    args = sys.argv[1:]
+    loan_ids = [arg for arg in args if arg not in ("--batch", "--no-cache", "--pretty")] or ["1000182227"]
+    use_cache = "--no-cache" not in args
+    pretty = "--pretty" in args
+    
+    if "--batch" in args:
+        asyncio.run(submit_batch(loan_ids, pretty))
+    elif len(loan_ids) == 1:
+        asyncio.run(analyze_loan(loan_ids[0], use_cache, pretty=pretty))
+    else:
+        asyncio.run(analyze_loans(loan_ids, use_cache, pretty))
+
+
 if __name__ == "__main__":
     main()
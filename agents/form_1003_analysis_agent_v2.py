@@ -6,13 +6,19 @@ to fill in values from raw JSON documents, ensuring consistent structure.
 """
 
 import json
+import orjson
 import os
+import re
 import sys
 from pathlib import Path
 from datetime import datetime
-from typing import Dict
-from openai import AzureOpenAI
+from typing import Dict, List, Tuple
+from openai import AzureOpenAI, BadRequestError
 from dotenv import load_dotenv
+from _loan_io import (
+    load_all_loan_json_files, save_1003_analysis, identify_1003_files_heuristic,
+    response_cache_key, load_cached_response, save_cached_response
+)
 
 load_dotenv()
 
@@ -21,61 +27,63 @@ deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT")
 subscription_key = os.getenv("AZURE_OPENAI_KEY")
 api_version = os.getenv("AZURE_OPENAI_API_VERSION")
 
-client = AzureOpenAI(
-    api_key=subscription_key,
-    api_version=api_version,
-    azure_endpoint=endpoint
-)
+# Shared Azure OpenAI client, created on first use so importing this module
+# (e.g. to dispatch to it) doesn't build a client or need credentials
+_client = None
 
+def get_client():
+    """Return the shared Azure OpenAI client, creating it on first use."""
+    global _client
+    if _client is None:
+        _client = AzureOpenAI(
+            api_key=subscription_key,
+            api_version=api_version,
+            azure_endpoint=endpoint
+        )
+    return _client
 
-def load_schema_template() -> Dict:
-    """Load the Form 1003 JSON schema template."""
-    schema_path = Path("utils/form_1003_schema.json")
-    with open(schema_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+# Prompts longer than the model context (minus room for the output) would
+# fail only after a full round trip; ~4 characters per token
+MODEL_CONTEXT_TOKENS = int(os.getenv("MODEL_CONTEXT_TOKENS", "128000"))
+MAX_COMPLETION_TOKENS = 16000
+MAX_PROMPT_CHARS = (MODEL_CONTEXT_TOKENS - MAX_COMPLETION_TOKENS) * 4
+# Greedy, seeded decoding: extraction wants the same answer for the same request
+TEMPERATURE = 0
+SEED = 42
+# Small loans share one request (and its instructions and schema) up to this
+# many at a time, and only while their filled schemas fit MAX_COMPLETION_TOKENS
+MAX_LOANS_PER_PROMPT = 3
+# A filled schema is estimated at this many times the compact template
+# (values and repeated array items are longer than the placeholders)
+FILLED_SCHEMA_EXPANSION = 3
 
+# Structured-output schema limits (OpenAI's current ones; deployments on API
+# versions documenting 100 properties / 5 levels can lower them): a larger
+# schema is requested in plain JSON mode instead of being rejected
+STRICT_SCHEMA_MAX_PROPERTIES = int(os.getenv("STRICT_SCHEMA_MAX_PROPERTIES", "5000"))
+STRICT_SCHEMA_MAX_NESTING = int(os.getenv("STRICT_SCHEMA_MAX_NESTING", "10"))
+JSON_OBJECT_FORMAT = {"type": "json_object"}
+# Set once the service rejects a strict schema, so the process's later
+# requests go straight to JSON mode
+_strict_schema_rejected = False
 
-def load_all_loan_json_files(loan_id: str) -> Dict[str, Dict]:
-    """Load all JSON files for a given loan."""
-    json_dir = Path(f"loan_docs/{loan_id}/json")
-    
-    if not json_dir.exists():
-        print(f"JSON directory not found: {json_dir}")
-        return {}
-    
-    json_files = {}
-    for json_file in json_dir.glob("*.json"):
-        try:
-            with open(json_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                json_files[json_file.stem] = data
-        except Exception as e:
-            print(f"Error loading {json_file.name}: {e}")
-    
-    return json_files
+# Primary borrower name as it appears in the streamed reply (the schema puts
+# it near the start), shown before the rest of the extraction arrives
+PRIMARY_BORROWER_NAME_PATTERN = re.compile(r'"primary_borrower"\s*:\s*\{\s*"name"\s*:\s*"([^"]*)"')
 
 
-def extract_1003_with_schema(loan_id: str, json_data: Dict[str, Dict], schema: Dict) -> Dict:
-    """
-    Extract Form 1003 data using the provided schema as a strict template.
-    The LLM fills in the schema fields from raw JSON documents.
-    """
-    
-    print(f"\n{'='*80}")
-    print("SCHEMA-DRIVEN FORM 1003 EXTRACTION")
-    print(f"{'='*80}\n")
-    
-    print("Loading schema template...")
-    print(f"Analyzing {len(json_data)} JSON documents...")
-    
-    # Create the comprehensive prompt
-    prompt = f"""You are an expert mortgage document analyst extracting Form 1003 (Uniform Residential Loan Application) data.
+# Static instructions wrapped around the schema template: identical on every
+# call, so they lead the request (system message) where the service can cache
+# the prompt prefix
+SCHEMA_SYSTEM_PROMPT = """You are an expert mortgage document analyst. You extract Form 1003 data with perfect accuracy and fill JSON schemas precisely according to specifications.
+
+You are an expert mortgage document analyst extracting Form 1003 (Uniform Residential Loan Application) data.
 
 **CRITICAL INSTRUCTIONS:**
 
 You will be provided with:
 1. A JSON SCHEMA TEMPLATE that defines the exact structure required
-2. Raw JSON documents from a mortgage loan file
+2. Raw JSON documents from a mortgage loan file (in the user message)
 
 Your task:
 - Fill in the schema template with values extracted from the raw JSON documents
@@ -86,120 +94,459 @@ Your task:
 
 **JSON SCHEMA TEMPLATE TO FILL:**
 
-{json.dumps(schema, indent=2)}
-
-**RAW LOAN DOCUMENTS (all JSON files in the package):**
-
-{json.dumps(json_data, indent=2)}
+{schema}
 
 **YOUR TASK:**
 
 Return the FILLED schema as valid JSON. Every field in the schema should be populated with actual values from the documents or appropriate null/empty values if data is not available.
 
 IMPORTANT:
-- Set loan_id to "{loan_id}"
+- Set loan_id to the loan_id given in the user message
 - Set analysis_date to the current ISO timestamp
 - Extract ALL Form 1003 data you find across all documents
 - Be thorough and accurate - downstream agents depend on this data
 - Use exact values from documents (don't paraphrase or summarize)
 - For dates, use YYYY-MM-DD format
 - For phone numbers, use (XXX) XXX-XXXX format
-- For dollar amounts, use numbers (not strings)
+- For dollar amounts, use numbers (not strings)"""
 
-Return ONLY the filled JSON schema. No explanations, no markdown, just valid JSON.
-"""
+
+# Item templates for the arrays left empty in utils/form_1003_schema.json, by
+# dotted path (list elements add no segment); strict mode only lets the model
+# return items of the type given here
+ACCOUNT_ITEM_TEMPLATE = {
+    "account_type": "Checking|Savings|401(k)|IRA|etc",
+    "financial_institution": "INSTITUTION NAME",
+    "account_number": "ACCOUNT NUMBER",
+    "cash_or_market_value": 0.0,
+    "owner": "BORROWER NAME"
+}
+ARRAY_ITEM_TEMPLATES = {
+    "assertions.borrower_information.primary_borrower.dependents.ages": 0,
+    "assertions.borrower_information.primary_borrower.credit_score.key_factors_adversely_affecting_score": "string",
+    "assertions.borrower_information.co_borrower.dependents.ages": 0,
+    "assertions.borrower_information.co_borrower.credit_score.key_factors_adversely_affecting_score": "string",
+    "assertions.employment_and_income.primary_borrower.documents_needed_to_validate": "DOCUMENT TYPE",
+    "assertions.employment_and_income.co_borrower.documents_needed_to_validate": "DOCUMENT TYPE",
+    "assertions.assets.declared_on_1003.bank_accounts": ACCOUNT_ITEM_TEMPLATE,
+    "assertions.assets.declared_on_1003.retirement_accounts": ACCOUNT_ITEM_TEMPLATE,
+    "assertions.assets.declared_on_1003.other_assets": {
+        "asset_type": "Earnest Money|Gift|Proceeds from Sale|etc",
+        "description": "string or null",
+        "cash_or_market_value": 0.0,
+        "owner": "BORROWER NAME"
+    },
+    "assertions.assets.real_estate_owned_listed_as_asset.documents_needed_to_validate": "DOCUMENT TYPE",
+    "assertions.liabilities.documents_needed_to_validate": "DOCUMENT TYPE",
+    "assertions.property_information.documents_needed_to_validate": "DOCUMENT TYPE",
+    "assertions.loan_details.documents_needed_to_validate": "DOCUMENT TYPE",
+    "assertions.declarations_and_acknowledgements.borrowers_certification_and_authorization.signatures": {
+        "signer_name": "NAME",
+        "role": "Borrower|Co-Borrower|Loan Originator|etc",
+        "signature_type": "Wet|Electronic|etc",
+        "date_signed": "YYYY-MM-DD"
+    },
+    "assertions.declarations_and_acknowledgements.tax_transcript_consent.4506_c_signed_for.years_requested": "YYYY",
+    "assertions.declarations_and_acknowledgements.other_disclosures_signed": {
+        "disclosure_name": "DISCLOSURE NAME",
+        "signed_by": "NAME",
+        "date_signed": "YYYY-MM-DD"
+    },
+    "assertions.additional_notes_and_items_requested_by_lender.notice_of_incomplete_application_requested_items": "string",
+    "metadata.validation_categories.pulled_data": "DOCUMENT TYPE",
+    "metadata.validation_categories.submitted_documents": "DOCUMENT TYPE"
+}
+
+
+def load_schema_template() -> Dict:
+    """Load the Form 1003 JSON schema template."""
+    schema_path = Path("utils/form_1003_schema.json")
+    with open(schema_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def template_to_json_schema(template, path: str = ""):
+    """
+    Build a strict JSON Schema from the schema template.
+    
+    Every object key is required and no other keys are allowed; arrays take
+    their item schema from the template's first element, or from
+    ARRAY_ITEM_TEMPLATES when the template array is empty; leaves keep the
+    template value's type but may be null, with placeholder text such as
+    'YYYY-MM-DD' as their description.
+    """
+    if isinstance(template, dict):
+        return {
+            "type": "object",
+            "properties": {
+                key: template_to_json_schema(value, f"{path}.{key}" if path else key)
+                for key, value in template.items()
+            },
+            "required": list(template),
+            "additionalProperties": False
+        }
+    if isinstance(template, list):
+        if template:
+            item_template = template[0]
+        elif path in ARRAY_ITEM_TEMPLATES:
+            item_template = ARRAY_ITEM_TEMPLATES[path]
+        else:
+            # Strict mode would only allow whatever item type we guessed here
+            raise ValueError(f"Schema template array {path} is empty; add its item to ARRAY_ITEM_TEMPLATES")
+        return {"type": "array", "items": template_to_json_schema(item_template, path)}
+    if isinstance(template, bool):
+        return {"type": ["boolean", "null"]}
+    if isinstance(template, int):
+        return {"type": ["integer", "null"]}
+    if isinstance(template, float):
+        return {"type": ["number", "null"]}
+    if isinstance(template, str):
+        return {"type": ["string", "null"], "description": template}
+    return {"type": ["string", "number", "null"]}
+
+
+def schema_size(json_schema: Dict, nesting: int = 1) -> Tuple[int, int]:
+    """(object properties, object nesting levels) of a JSON Schema, as the structured-output limits count them."""
+    if json_schema.get("type") == "array":
+        return schema_size(json_schema["items"], nesting)
+    if json_schema.get("type") != "object":
+        return 0, nesting - 1
+    properties, max_nesting = len(json_schema["properties"]), nesting
+    for value in json_schema["properties"].values():
+        value_properties, value_nesting = schema_size(value, nesting + 1)
+        properties += value_properties
+        max_nesting = max(max_nesting, value_nesting)
+    return properties, max_nesting
+
+
+def schema_response_format(name: str, json_schema: Dict) -> Dict:
+    """
+    Structured-output response format: the reply is constrained to json_schema.
     
-    print("Calling Azure OpenAI with schema template...")
-    print("This may take a moment due to comprehensive extraction...\n")
+    Plain JSON mode instead when the schema exceeds the structured-output
+    limits or the service has already rejected a strict schema.
+    """
+    if _strict_schema_rejected:
+        return JSON_OBJECT_FORMAT
+    properties, nesting = schema_size(json_schema)
+    if properties > STRICT_SCHEMA_MAX_PROPERTIES or nesting > STRICT_SCHEMA_MAX_NESTING:
+        print(f"⚠️  Schema {name} ({properties} properties, {nesting} levels) exceeds the structured-output limits; using JSON mode")
+        return JSON_OBJECT_FORMAT
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "schema": json_schema, "strict": True}
+    }
+
+
+def complete_json(messages: List[Dict], response_format: Dict, use_cache: bool = True) -> Dict:
+    """
+    Send a structured-output chat request and parse the response.
     
+    A strict schema the service rejects is retried once in plain JSON mode
+    (as are the process's later requests). An identical request made before
+    reuses the cached response unless use_cache is False; only responses
+    that parse are cached.
+    """
+    global _strict_schema_rejected
     try:
-        response = client.chat.completions.create(
-            model=deployment,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert mortgage document analyst. You extract Form 1003 data with perfect accuracy and fill JSON schemas precisely according to specifications."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            response_format={"type": "json_object"},
-            max_completion_tokens=16000
-        )
-        
-        filled_schema = json.loads(response.choices[0].message.content)
-        
-        print(f"✅ Successfully extracted Form 1003 data using schema template!")
-        
-        # Print summary
-        print(f"\n📊 EXTRACTION SUMMARY:")
-        print(f"   Loan ID: {filled_schema.get('loan_id', 'Unknown')}")
-        
-        assertions = filled_schema.get('assertions', {})
-        
-        if 'process_anchor' in assertions:
-            anchor = assertions['process_anchor']
-            app_date = anchor.get('application_date', 'Not found')
-            print(f"   Application Date (Day 0): {app_date}")
+        return request_json(messages, response_format, use_cache)
+    except BadRequestError as e:
+        if response_format.get("type") != "json_schema" or "response_format" not in f"{getattr(e, 'param', '')} {e}":
+            raise
+        print(f"⚠️  Strict schema rejected, retrying in JSON mode: {e}")
+        _strict_schema_rejected = True
+        return request_json(messages, JSON_OBJECT_FORMAT, use_cache)
+
+
+def request_json(messages: List[Dict], response_format: Dict, use_cache: bool = True) -> Dict:
+    """Send one chat request with response_format (or reuse its cached response) and parse it."""
+    request = {
+        "model": deployment,
+        "messages": messages,
+        "response_format": response_format,
+        "max_completion_tokens": MAX_COMPLETION_TOKENS,
+        "temperature": TEMPERATURE,
+        "seed": SEED
+    }
+    cache_key = response_cache_key(request)
+    content = load_cached_response(cache_key) if use_cache else None
+    
+    if content is not None:
+        print("♻️  Cache hit for identical request, skipped LLM call\n")
+    else:
+        print("Calling Azure OpenAI with schema template...")
+        print("This may take a moment due to comprehensive extraction...\n")
         
-        if 'borrower_information' in assertions:
-            borrowers = assertions['borrower_information']
-            if borrowers.get('primary_borrower'):
-                print(f"   Primary Borrower: {borrowers['primary_borrower'].get('name', 'Unknown')}")
-            if borrowers.get('co_borrower') and borrowers['co_borrower'].get('name'):
-                print(f"   Co-Borrower: {borrowers['co_borrower'].get('name')}")
+        stream = get_client().chat.completions.create(**request, stream=True)
         
-        if 'loan_details' in assertions:
-            loan = assertions['loan_details']
-            print(f"   Loan Amount: ${loan.get('loan_amount_requested', 0):,.2f}")
-            print(f"   Loan Purpose: {loan.get('loan_purpose', 'Unknown')}")
+        # Assemble the streamed reply, printing borrower names as soon as
+        # they are generated; only a short tail is scanned per chunk
+        parts = []
+        tail = ""
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content or ""
+            parts.append(delta)
+            tail = (tail + delta)[-256:]
+            match = PRIMARY_BORROWER_NAME_PATTERN.search(tail)
+            if match:
+                print(f"   Streaming... Primary Borrower: {match.group(1)}")
+                tail = tail[match.end():]
+        content = "".join(parts)
+    
+    result = json.loads(content)
+    if use_cache:
+        save_cached_response(cache_key, content)
+    return result
+
+
+def extract_1003_with_schema(loan_id: str, json_data: Dict[str, Dict], schema: Dict, use_cache: bool = True) -> Dict:
+    """
+    Extract Form 1003 data using the provided schema as a strict template.
+    The LLM fills in the schema fields from raw JSON documents.
+    An identical request made before reuses the cached response unless
+    use_cache is False.
+    """
+    
+    print(f"\n{'='*80}")
+    print("SCHEMA-DRIVEN FORM 1003 EXTRACTION")
+    print(f"{'='*80}\n")
+    
+    print("Loading schema template...")
+    print(f"Analyzing {len(json_data)} JSON documents...")
+    
+    system_prompt = SCHEMA_SYSTEM_PROMPT.format(schema=json.dumps(schema, indent=2))
+    documents_json = orjson.dumps(json_data).decode()
+    prompt_chars = len(system_prompt) + len(documents_json)
+    
+    # The whole package doesn't fit the model context: send only the files
+    # recognizable as the 1003 instead of a request that is bound to fail
+    if prompt_chars > MAX_PROMPT_CHARS:
+        candidates = identify_1003_files_heuristic(json_data)
+        print(f"⚠️  Prompt of ~{prompt_chars // 4} tokens exceeds the ~{MAX_PROMPT_CHARS // 4} token limit; "
+              f"narrowing to {len(candidates)} recognized Form 1003 file(s)")
+        documents_json = orjson.dumps({filename: json_data[filename] for filename in candidates}).decode()
+        prompt_chars = len(system_prompt) + len(documents_json)
+        if not candidates or prompt_chars > MAX_PROMPT_CHARS:
+            print(f"❌ Error: Form 1003 documents don't fit the model context (~{prompt_chars // 4} tokens)")
+            return {}
+    
+    print(f"Prompt size: ~{prompt_chars // 4} tokens")
+    
+    # Only the loan documents and loan_id vary between calls; they follow the
+    # static instructions and schema so every request shares the same prefix
+    prompt = f"""**RAW LOAN DOCUMENTS (all JSON files in the package):**
+
+{documents_json}
+
+Set loan_id to "{loan_id}".
+"""
+    
+    messages = [
+        {
+            "role": "system",
+            "content": system_prompt
+        },
+        {
+            "role": "user",
+            "content": prompt
+        }
+    ]
+    
+    try:
+        filled_schema = complete_json(messages, schema_response_format("form_1003", template_to_json_schema(schema)), use_cache)
         
-        if 'employment_and_income' in assertions:
-            emp = assertions['employment_and_income']
-            if emp.get('primary_borrower'):
-                income = emp['primary_borrower'].get('gross_monthly_income', {})
-                print(f"   Primary Income: ${income.get('total', 0):,.2f}/month")
-            if emp.get('co_borrower'):
-                income = emp['co_borrower'].get('gross_monthly_income', {})
-                print(f"   Co-Borrower Income: ${income.get('total', 0):,.2f}/month")
+        print(f"✅ Successfully extracted Form 1003 data using schema template!")
+        print_extraction_summary(filled_schema)
         
         return filled_schema
         
-    except json.JSONDecodeError as e:
-        print(f"❌ Error: LLM did not return valid JSON: {e}")
-        return {}
     except Exception as e:
         print(f"❌ Error during extraction: {e}")
         return {}
 
 
-def save_1003_analysis(loan_id: str, analysis: Dict):
-    """Save the analysis to a JSON file for downstream processing."""
+def print_extraction_summary(filled_schema: Dict):
+    """Print the headline values of a filled Form 1003 schema."""
+    assertions = filled_schema.get('assertions') or {}
+    anchor = assertions.get('process_anchor')
+    borrowers = assertions.get('borrower_information') or {}
+    primary_borrower = borrowers.get('primary_borrower') or {}
+    co_borrower = borrowers.get('co_borrower') or {}
+    loan = assertions.get('loan_details')
+    employment = assertions.get('employment_and_income') or {}
+    primary_employment = employment.get('primary_borrower')
+    co_employment = employment.get('co_borrower')
+    
+    print(f"\n📊 EXTRACTION SUMMARY:")
+    print(f"   Loan ID: {filled_schema.get('loan_id', 'Unknown')}")
+    
+    if anchor is not None:
+        print(f"   Application Date (Day 0): {anchor.get('application_date', 'Not found')}")
     
-    # Save to JSON in loan-specific reports folder
-    report_dir = Path(f"loan_docs/{loan_id}/reports")
-    report_dir.mkdir(parents=True, exist_ok=True)
+    if primary_borrower:
+        print(f"   Primary Borrower: {primary_borrower.get('name', 'Unknown')}")
+    if co_borrower.get('name'):
+        print(f"   Co-Borrower: {co_borrower['name']}")
     
-    json_file = report_dir / "form_1003_analysis.json"
+    # Schema leaves may be null: amounts print as 0 rather than failing the extraction
+    if loan is not None:
+        print(f"   Loan Amount: ${loan.get('loan_amount_requested') or 0:,.2f}")
+        print(f"   Loan Purpose: {loan.get('loan_purpose', 'Unknown')}")
     
-    with open(json_file, 'w', encoding='utf-8') as f:
-        json.dump(analysis, f, indent=2)
+    if primary_employment:
+        income = primary_employment.get('gross_monthly_income') or {}
+        print(f"   Primary Income: ${income.get('total') or 0:,.2f}/month")
+    if co_employment:
+        income = co_employment.get('gross_monthly_income') or {}
+        print(f"   Co-Borrower Income: ${income.get('total') or 0:,.2f}/month")
+
+
+def extract_1003_batch(loan_bundles: List[Tuple[str, Dict[str, Dict]]], schema: Dict, use_cache: bool = True) -> Dict[str, Dict]:
+    """
+    Extract Form 1003 data for several small loans in one request.
+    
+    The static instructions and schema are sent once for all loans instead of
+    once per loan. Each loan's documents follow a ===LOAN <loan_id>=== marker,
+    and the model returns {"loans": {"<loan_id>": <filled schema>, ...}}.
+    Returns the filled schemas by loan_id; a loan missing from the response
+    is left out.
+    """
+    
+    loan_ids = [loan_id for loan_id, _ in loan_bundles]
     
     print(f"\n{'='*80}")
-    print(f"💾 Analysis saved to: {json_file}")
+    print(f"SCHEMA-DRIVEN FORM 1003 EXTRACTION - {len(loan_ids)} loans in one request")
     print(f"{'='*80}\n")
     
-    return json_file
+    loan_sections = "".join(
+        f"===LOAN {loan_id}===\n{orjson.dumps(json_data).decode()}\n"
+        for loan_id, json_data in loan_bundles
+    )
+    prompt = f"""**RAW LOAN DOCUMENTS (all JSON files in each loan package):**
+
+{loan_sections}
+This request covers {len(loan_ids)} loans: {", ".join(loan_ids)}.
+Fill in one schema per loan, using ONLY that loan's documents, and set each schema's loan_id to its loan.
+Return {{"loans": {{"<loan_id>": <filled schema>, ...}}}} with one entry per loan.
+"""
+    
+    messages = [
+        {
+            "role": "system",
+            "content": SCHEMA_SYSTEM_PROMPT.format(schema=json.dumps(schema, indent=2))
+        },
+        {
+            "role": "user",
+            "content": prompt
+        }
+    ]
+    
+    # One required filled schema per loan, keyed by its loan_id
+    loan_schema = template_to_json_schema(schema)
+    response_schema = {
+        "type": "object",
+        "properties": {
+            "loans": {
+                "type": "object",
+                "properties": {loan_id: loan_schema for loan_id in loan_ids},
+                "required": loan_ids,
+                "additionalProperties": False
+            }
+        },
+        "required": ["loans"],
+        "additionalProperties": False
+    }
+    
+    try:
+        result = complete_json(messages, schema_response_format("form_1003_loans", response_schema), use_cache)
+    except Exception as e:
+        print(f"❌ Error during extraction: {e}")
+        return {}
+    
+    filled_schemas = result.get('loans') or {}
+    return {loan_id: filled_schemas[loan_id] for loan_id in loan_ids if filled_schemas.get(loan_id)}
+
+
+def bundle_small_loans(loans: List[Tuple[str, Dict[str, Dict]]], schema: Dict) -> List[List[Tuple[str, Dict[str, Dict]]]]:
+    """
+    Group loans into request bundles.
+    
+    Loans are packed in order, at most MAX_LOANS_PER_PROMPT per bundle and only
+    while the combined prompt stays within MAX_PROMPT_CHARS and the estimated
+    filled schemas within MAX_COMPLETION_TOKENS; a loan that doesn't fit
+    alongside others gets a bundle of its own.
+    """
+    schema_chars = len(SCHEMA_SYSTEM_PROMPT) + len(json.dumps(schema, indent=2))
+    # ~4 characters per token
+    loan_output_tokens = len(orjson.dumps(schema)) * FILLED_SCHEMA_EXPANSION // 4
+    max_loans = max(1, min(MAX_LOANS_PER_PROMPT, MAX_COMPLETION_TOKENS // loan_output_tokens))
+    bundles = []
+    current, current_chars = [], schema_chars
+    for loan_id, json_data in loans:
+        loan_chars = len(orjson.dumps(json_data))
+        if current and (len(current) == max_loans or current_chars + loan_chars > MAX_PROMPT_CHARS):
+            bundles.append(current)
+            current, current_chars = [], schema_chars
+        current.append((loan_id, json_data))
+        current_chars += loan_chars
+    if current:
+        bundles.append(current)
+    return bundles
+
+
+def analyze_loans(loan_ids: List[str], schema: Dict, use_cache: bool = True, pretty: bool = False):
+    """Extract and save Form 1003 data for several loans, sharing requests between small loans."""
+    loans = []
+    for loan_id in loan_ids:
+        print(f"Loading loan documents for {loan_id}...")
+        json_data = load_all_loan_json_files(loan_id)
+        if not json_data:
+            print(f"❌ No JSON files found for {loan_id}, skipping")
+            continue
+        loans.append((loan_id, json_data))
+    
+    analyses = {}
+    for bundle in bundle_small_loans(loans, schema):
+        if len(bundle) == 1:
+            loan_id, json_data = bundle[0]
+            analysis = extract_1003_with_schema(loan_id, json_data, schema, use_cache)
+            if analysis:
+                analyses[loan_id] = analysis
+            continue
+        
+        filled_schemas = extract_1003_batch(bundle, schema, use_cache)
+        for loan_id, json_data in bundle:
+            if loan_id in filled_schemas:
+                print(f"✅ Extracted Form 1003 data for loan {loan_id}")
+                print_extraction_summary(filled_schemas[loan_id])
+                analyses[loan_id] = filled_schemas[loan_id]
+                continue
+            # Failed or truncated shared request, or a loan it left out: that
+            # loan gets a request of its own
+            print(f"⚠️  Loan {loan_id} missing from the shared request, extracting it on its own")
+            analysis = extract_1003_with_schema(loan_id, json_data, schema, use_cache)
+            if analysis:
+                analyses[loan_id] = analysis
+    
+    for loan_id, _ in loans:
+        if loan_id in analyses:
+            save_1003_analysis(loan_id, analyses[loan_id], pretty)
+        else:
+            print(f"❌ Failed to extract Form 1003 data for loan {loan_id}!")
+    
+    print(f"✅ Form 1003 analysis complete: {len(analyses)}/{len(loan_ids)} loans")
 
 
 def main():
-    # Accept loan_id from command line argument or use default
-    if len(sys.argv) > 1:
-        loan_id = sys.argv[1]
-    else:
-        loan_id = "1000182227"
+    # Accept loan_ids from command line arguments or use default;
+    # --no-cache always calls the LLM instead of reusing a cached response;
+    # --pretty saves the report indented instead of compact
+    args = [arg for arg in sys.argv[1:] if arg not in ("--no-cache", "--pretty")]
+    use_cache = "--no-cache" not in sys.argv[1:]
+    pretty = "--pretty" in sys.argv[1:]
+    loan_ids = args or ["1000182227"]
     
     print(f"\n{'='*80}")
     print("FORM 1003 ANALYSIS AGENT (Schema-Driven v2)")
@@ -210,6 +557,12 @@ def main():
     schema = load_schema_template()
     print(f"✅ Schema loaded with {len(schema.keys())} top-level fields\n")
     
+    # Several loans: small ones share requests
+    if len(loan_ids) > 1:
+        analyze_loans(loan_ids, schema, use_cache, pretty)
+        return
+    loan_id = loan_ids[0]
+    
     # Load all JSON files
     print(f"Loading loan documents for {loan_id}...")
     json_data = load_all_loan_json_files(loan_id)
@@ -221,14 +574,14 @@ def main():
     print(f"✅ Loaded {len(json_data)} JSON documents\n")
     
     # Extract using schema
-    analysis = extract_1003_with_schema(loan_id, json_data, schema)
+    analysis = extract_1003_with_schema(loan_id, json_data, schema, use_cache)
     
     if not analysis:
         print("\n❌ Failed to extract Form 1003 data!")
         return
     
     # Save results
-    output_file = save_1003_analysis(loan_id, analysis)
+    output_file = save_1003_analysis(loan_id, analysis, pretty)
     
     print("\n" + "="*80)
     print("✅ FORM 1003 ANALYSIS COMPLETE")
@@ -7,113 +7,125 @@ into a complete, accurate Form 1003 JSON following the official schema.
 This agent:
 1. Loads all semantic_json/* files
 2. Loads the Form 1003 schema template
-3. Uses LLM to intelligently map semantic data to Form 1003 fields
+3. Uses LLM to intelligently map semantic data to Form 1003 fields,
+   one request per schema section, all sections in parallel
 4. Respects that values may have changed during underwriting
 5. Prioritizes the most recent/authoritative source for each field
 6. Flags any conflicts or uncertainties
 
 Usage:
-    python agents/form_1003_consolidation_agent.py <loan_id>
+    python agents/form_1003_consolidation_agent.py [--no-cache] [--force] <loan_id>
+    python agents/form_1003_consolidation_agent.py --batch [--no-cache] [--force] [<loan_id> ...]
     
 Example:
     python agents/form_1003_consolidation_agent.py 1000182227
+
+--batch consolidates many loans as one Azure OpenAI Batch job (24h completion
+window, roughly half the token cost); without loan ids it takes every loan
+under loan_docs/ that has semantic JSON. A loan whose semantic documents are
+unchanged since a previous run reuses that run's consolidation (cached under
+loan_docs/_cache/form_1003_consolidated/); --no-cache always calls the LLM.
+A loan whose latest consolidated report is complete, made with the current
+prompts, and newer than all of its semantic JSON is skipped; --force
+consolidates it again.
 """
 
 import os
 import sys
-import json
+import orjson
+import random
+import asyncio
+import hashlib
+import functools
+import tempfile
 from pathlib import Path
-from openai import AzureOpenAI
+from concurrent.futures import ThreadPoolExecutor
+from openai import AsyncAzureOpenAI, RateLimitError, APITimeoutError, APIConnectionError, InternalServerError
 from dotenv import load_dotenv
 from datetime import datetime
 
 load_dotenv()
 
-# Initialize Azure OpenAI client
+# Azure OpenAI settings
 endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
 deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT")
 subscription_key = os.getenv("AZURE_OPENAI_KEY")
 api_version = os.getenv("AZURE_OPENAI_API_VERSION")
+REQUIRED_ENV_VARS = ("AZURE_OPENAI_ENDPOINT", "AZURE_OPENAI_DEPLOYMENT", "AZURE_OPENAI_KEY", "AZURE_OPENAI_API_VERSION")
 
-client = AzureOpenAI(
-    api_key=subscription_key,
-    api_version=api_version,
-    azure_endpoint=endpoint
-)
+# Shared Azure OpenAI client, created on first use so importing this module
+# (or a run served from the cache) doesn't build a client or need credentials
+_client = None
 
+def get_client():
+    """
+    Return the shared Azure OpenAI client, creating it on first use.
+    
+    Raises RuntimeError naming any missing REQUIRED_ENV_VARS instead of
+    failing later inside the SDK.
+    """
+    global _client
+    if _client is None:
+        missing = [var for var in REQUIRED_ENV_VARS if not os.getenv(var)]
+        if missing:
+            raise RuntimeError(f"Missing Azure OpenAI settings: {', '.join(missing)} (set them in .env)")
+        _client = AsyncAzureOpenAI(
+            api_key=subscription_key,
+            api_version=api_version,
+            azure_endpoint=endpoint,
+            timeout=120.0
+        )
+    return _client
 
-def load_form_1003_schema():
-    """Load the Form 1003 JSON schema template."""
-    schema_path = Path("form_1003/form_1003_schema.json")
-    with open(schema_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+MAX_RETRIES = 3
+# Whole Form 1003 in one reply (Batch requests) can be large
+MAX_COMPLETION_TOKENS = 16000
+# A single section starts with a small output budget (max_completion_tokens
+# adds latency even when unused); a reply cut off at the limit is retried
+# with twice the budget, up to MAX_SECTION_COMPLETION_TOKENS
+SECTION_COMPLETION_TOKENS = 2000
+MAX_SECTION_COMPLETION_TOKENS = 8000
 
+# Document types each section is consolidated from (the DATA SOURCE PRIORITY
+# list), matched against each semantic document's document_type and name;
+# a section matching no document gets all of them
+SECTION_SOURCES = {
+    'lender_info': ('settlement', 'closing disclosure'),
+    'section_1_borrower_info': ('1003', 'loan application', 'paystub', 'pay stub', 'w-2', 'w2', 'settlement', 'closing disclosure', 'underwriting'),
+    'section_2_financial_assets_liabilities': ('1003', 'loan application', 'credit', 'bank statement'),
+    'section_3_real_estate': ('1003', 'loan application', 'appraisal', 'mortgage statement'),
+    'section_4_loan_property_info': ('settlement', 'closing disclosure', 'appraisal', 'underwriting', 'insurance'),
+    'section_5_declarations': ('1003', 'loan application'),
+    'section_6_acknowledgments': ('1003', 'loan application', 'settlement', 'closing disclosure'),
+    'section_7_military_service': ('1003', 'loan application'),
+    'section_8_demographic_info': ('1003', 'loan application'),
+    'section_9_loan_originator_info': ('settlement', 'closing disclosure', '1003', 'loan application'),
+}
 
-def load_all_semantic_json(loan_id):
-    """Load all semantic JSON files for a loan."""
-    semantic_dir = Path(f"loan_docs/{loan_id}/semantic_json")
-    
-    if not semantic_dir.exists():
-        print(f"❌ Semantic JSON directory not found: {semantic_dir}")
-        print("   Run document_semantic_processor.py first!")
-        return {}
-    
-    semantic_docs = {}
-    for json_file in semantic_dir.glob("*.json"):
-        try:
-            with open(json_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # Use a clean key name
-                clean_name = json_file.stem.replace("__aws-prd-nfs03_Deals_Trade__SpringEQ_Src_453_1000182227_", "")
-                semantic_docs[clean_name] = data
-        except Exception as e:
-            print(f"⚠️  Error loading {json_file.name}: {e}")
-    
-    return semantic_docs
+# Threads used to read and parse a loan's semantic JSON files
+MAX_READ_WORKERS = 16
+# Source-system path prefix stripped from semantic JSON file names
+SEMANTIC_FILENAME_PREFIX = "__aws-prd-nfs03_Deals_Trade__SpringEQ_Src_453_1000182227_"
+# Consolidated Form 1003s cached by (semantic documents, schema, model,
+# PROMPT_VERSION); bump PROMPT_VERSION whenever the prompts change
+CACHE_DIR = Path("loan_docs/_cache/form_1003_consolidated")
+PROMPT_VERSION = "v1"
 
+# Semantic JSON keys with nothing to consolidate (the semantic processor's
+# processing metadata: source file, model, compression stats)
+PROMPT_EXCLUDED_KEYS = frozenset({'_metadata'})
 
-def consolidate_form_1003(loan_id="1000182227"):
-    """
-    Consolidate all semantic JSONs into a complete Form 1003.
-    """
-    
-    print("=" * 80)
-    print(f"Form 1003 Consolidation Agent - Loan {loan_id}")
-    print("=" * 80)
-    print()
-    
-    # Load schema and semantic data
-    print("📋 Loading Form 1003 schema template...")
-    schema = load_form_1003_schema()
-    
-    print("📁 Loading all semantic JSON files...")
-    semantic_docs = load_all_semantic_json(loan_id)
-    
-    if not semantic_docs:
-        print("❌ No semantic JSON files found!")
-        return None
-    
-    print(f"✅ Loaded {len(semantic_docs)} semantic documents:")
-    for doc_name, doc_data in semantic_docs.items():
-        doc_type = doc_data.get('document_type', 'unknown')
-        print(f"   - {doc_name}: {doc_type}")
-    
-    print()
-    print("=" * 80)
-    print("🤖 Sending to LLM for intelligent consolidation...")
-    print("=" * 80)
-    print()
-    
-    # Build comprehensive prompt
-    prompt = f"""You are a Mortgage Loan Processing AI with expertise in Form 1003 (Uniform Residential Loan Application).
+# Persona, instructions and schema: identical for every loan, so each request
+# starts with the same prefix and Azure OpenAI can reuse its prompt cache.
+# Only the semantic documents (user message) vary between loans.
+CONSOLIDATION_SYSTEM_PROMPT = """You are an expert Mortgage Loan Processor specializing in Form 1003 data consolidation. Output only valid JSON matching the provided schema.
 
-TASK: Consolidate data from multiple semantic loan documents into a complete, accurate Form 1003 JSON.
+You are a Mortgage Loan Processing AI with expertise in Form 1003 (Uniform Residential Loan Application).
 
-FORM 1003 SCHEMA (YOUR OUTPUT MUST MATCH THIS):
-{json.dumps(schema, indent=2)}
+TASK: Consolidate data from multiple semantic loan documents (in the user message) into a complete, accurate Form 1003 JSON.
 
-AVAILABLE SEMANTIC DOCUMENTS:
-{json.dumps(semantic_docs, indent=2)}
+FORM 1003 SCHEMA (YOUR OUTPUT MUST MATCH THIS):
+{schema}
 
 CRITICAL INSTRUCTIONS:
 
@@ -161,31 +173,206 @@ CRITICAL INSTRUCTIONS:
    - section_6_acknowledgments: Use Form 1003, settlement
    - section_7_military_service: Use Form 1003
    - section_8_demographic_info: Use Form 1003
-   - section_9_loan_originator_info: Use settlement statement
-
-BEGIN CONSOLIDATION. Output complete Form 1003 JSON now:"""
-
-    # Call LLM with extended timeout for complex processing
-    print("⏳ Processing (this may take 30-60 seconds for complex consolidation)...")
-    
-    response = client.chat.completions.create(
-        model=deployment,
-        messages=[
-            {
-                "role": "system", 
-                "content": "You are an expert Mortgage Loan Processor specializing in Form 1003 data consolidation. Output only valid JSON matching the provided schema."
-            },
-            {
-                "role": "user", 
-                "content": prompt
-            }
-        ],
-        response_format={"type": "json_object"},
-        max_completion_tokens=16000  # Form 1003 can be large
-    )
+   - section_9_loan_originator_info: Use settlement statement"""
+
+
+@functools.lru_cache(maxsize=1)
+def load_form_1003_schema():
+    """Load the Form 1003 JSON schema template (read once per process; don't mutate it)."""
+    schema_path = Path("form_1003/form_1003_schema.json")
+    with open(schema_path, 'rb') as f:
+        return orjson.loads(f.read())
+
+
+def _read_semantic_json(json_file):
+    """Parse one semantic JSON file, returning the exception instead of raising it."""
+    try:
+        with open(json_file, 'rb') as f:
+            return orjson.loads(f.read())
+    except Exception as e:
+        return e
+
+
+def load_all_semantic_json(loan_id):
+    """Load all semantic JSON files for a loan."""
+    semantic_dir = Path(f"loan_docs/{loan_id}/semantic_json")
+    
+    if not semantic_dir.exists():
+        print(f"❌ Semantic JSON directory not found: {semantic_dir}")
+        print("   Run document_semantic_processor.py first!")
+        return {}
+    
+    semantic_docs = {}
+    # scandir entries carry their file type; no Path objects or glob matching
+    with os.scandir(semantic_dir) as entries:
+        json_files = [entry for entry in entries
+                      if entry.name.endswith('.json') and entry.is_file()]
+    
+    # File reads are I/O bound: load them on a thread pool (results keep directory order)
+    with ThreadPoolExecutor(max_workers=MAX_READ_WORKERS) as executor:
+        for json_file, data in zip(json_files, executor.map(_read_semantic_json, json_files)):
+            if isinstance(data, Exception):
+                print(f"⚠️  Error loading {json_file.name}: {data}")
+                continue
+            # Use a clean key name
+            clean_name = json_file.name[:-len('.json')].replace(SEMANTIC_FILENAME_PREFIX, "")
+            semantic_docs[clean_name] = data
+    
+    return semantic_docs
+
+
+def _write_atomic(path, payload):
+    """Write bytes via a temp file + rename so readers never see a partial file."""
+    path = Path(path)
+    tmp_path = path.with_suffix('.tmp')
+    tmp_path.write_bytes(payload)
+    tmp_path.replace(path)
+
+
+@functools.lru_cache(maxsize=1)
+def consolidation_system_prompt():
+    """The static system prefix (instructions and compact schema), built once per process."""
+    return CONSOLIDATION_SYSTEM_PROMPT.format(schema=orjson.dumps(load_form_1003_schema()).decode())
+
+
+@functools.lru_cache(maxsize=1)
+def consolidation_prompt_fingerprint():
+    """Fingerprint the prompts, schema and model, recorded in each report's _metadata."""
+    return hashlib.blake2b(
+        consolidation_system_prompt().encode() + (deployment or '').encode() + PROMPT_VERSION.encode(),
+        digest_size=16
+    ).hexdigest()
+
+
+def consolidation_cache_key(semantic_docs):
+    """Fingerprint everything a consolidation depends on, for the consolidation cache."""
+    return hashlib.blake2b(
+        orjson.dumps(semantic_docs, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+        + consolidation_system_prompt().encode() + (deployment or '').encode() + PROMPT_VERSION.encode(),
+        digest_size=16
+    ).hexdigest()
+
+
+def load_cached_consolidation(cache_key):
+    """Return the cached consolidated Form 1003 for cache_key, or None on a miss."""
+    cache_path = CACHE_DIR / f"{cache_key}.json"
+    if not cache_path.exists():
+        return None
+    return orjson.loads(cache_path.read_bytes())
+
+
+def save_cached_consolidation(cache_key, consolidated_1003):
+    """Cache a consolidated Form 1003 (before processing metadata is added)."""
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    _write_atomic(CACHE_DIR / f"{cache_key}.json", orjson.dumps(consolidated_1003, option=orjson.OPT_NON_STR_KEYS))
+
+
+def _latest_report(loan_id):
+    """The loan's newest consolidated Form 1003 report, or None."""
+    reports = Path(f"loan_docs/{loan_id}/reports").glob(f"form_1003_consolidated_{loan_id}_*.json")
+    return max(reports, key=lambda report: report.stat().st_mtime, default=None)
+
+
+def up_to_date_report(loan_id):
+    """
+    The loan's newest consolidated report as (path, report) if it is complete,
+    was made with the current prompts, schema and model, and is newer than
+    the loan's semantic JSON (every file, and the folder itself so removed
+    files count); else None.
+    """
+    latest_report = _latest_report(loan_id)
+    semantic_dir = Path(f"loan_docs/{loan_id}/semantic_json")
+    if latest_report is None or not semantic_dir.exists():
+        return None
     
-    # Parse response
-    consolidated_1003 = json.loads(response.choices[0].message.content)
+    source_mtime = semantic_dir.stat().st_mtime
+    with os.scandir(semantic_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith('.json') and entry.is_file():
+                source_mtime = max(source_mtime, entry.stat().st_mtime)
+    
+    if latest_report.stat().st_mtime <= source_mtime:
+        return None
+    
+    # A report with failed sections, or from older prompts, is redone
+    report = orjson.loads(latest_report.read_bytes())
+    metadata = report.get('_metadata') or {}
+    if not metadata.get('complete') or metadata.get('prompt_fingerprint') != consolidation_prompt_fingerprint():
+        return None
+    return latest_report, report
+
+
+def serialize_semantic_docs(semantic_docs):
+    """
+    Compact JSON of each semantic document, without the keys the consolidation
+    doesn't use (PROMPT_EXCLUDED_KEYS). Serialized once per loan and reused by
+    every request that includes the document.
+    """
+    return {
+        doc_name: orjson.dumps(
+            {key: value for key, value in doc_data.items() if key not in PROMPT_EXCLUDED_KEYS},
+            option=orjson.OPT_NON_STR_KEYS
+        ).decode()
+        for doc_name, doc_data in semantic_docs.items()
+    }
+
+
+def select_section_docs(section, semantic_docs):
+    """The semantic documents a section is consolidated from (SECTION_SOURCES), or all of them."""
+    sources = SECTION_SOURCES.get(section)
+    if not sources:
+        return semantic_docs
+    
+    section_docs = {
+        doc_name: doc_data for doc_name, doc_data in semantic_docs.items()
+        if any(source in f"{doc_data.get('document_type', '')} {doc_name}".lower() for source in sources)
+    }
+    return section_docs or semantic_docs
+
+
+def build_consolidation_messages(doc_json, section=None):
+    """
+    Chat messages for one loan: the static system prefix, then the loan's
+    semantic documents (doc_json: serialize_semantic_docs output, or a subset
+    of it). With a section, only that section is requested.
+    """
+    if section:
+        instruction = (
+            f'CONSOLIDATE ONLY THE "{section}" SECTION of the Form 1003 schema.\n'
+            f'Output {{"{section}": <section JSON>, "_data_quality_notes": [<issues/conflicts for this section>]}} now:'
+        )
+    else:
+        instruction = "BEGIN CONSOLIDATION. Output complete Form 1003 JSON now:"
+    
+    # Only the semantic documents vary per loan; they follow the static system
+    # prefix. The documents object is joined from the per-document JSON.
+    prompt = "".join([
+        "AVAILABLE SEMANTIC DOCUMENTS:\n{",
+        ",".join(f"{orjson.dumps(doc_name).decode()}:{doc_data}" for doc_name, doc_data in doc_json.items()),
+        "}\n\n",
+        instruction
+    ])
+    
+    return [
+        {
+            "role": "system", 
+            "content": consolidation_system_prompt()
+        },
+        {
+            "role": "user", 
+            "content": prompt
+        }
+    ]
+
+
+def save_consolidated_1003(loan_id, consolidated_1003, source_documents, complete=True):
+    """
+    Add processing metadata to a consolidated Form 1003, save it to the loan's
+    reports folder and print its data quality notes and section summary.
+    
+    complete is False when sections failed; the up-to-date check never
+    skips such a report.
+    """
     
     # Add processing metadata if not already present
     if '_metadata' not in consolidated_1003:
@@ -193,9 +380,11 @@ BEGIN CONSOLIDATION. Output complete Form 1003 JSON now:"""
     
     consolidated_1003['_metadata'].update({
         'processing_date': datetime.now().isoformat(),
-        'source_documents_count': len(semantic_docs),
-        'source_documents': list(semantic_docs.keys()),
+        'source_documents_count': len(source_documents),
+        'source_documents': source_documents,
         'processing_model': deployment,
+        'prompt_fingerprint': consolidation_prompt_fingerprint(),
+        'complete': complete,
         'agent': 'form_1003_consolidation_agent'
     })
     
@@ -206,8 +395,8 @@ BEGIN CONSOLIDATION. Output complete Form 1003 JSON now:"""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     output_path = output_dir / f"form_1003_consolidated_{loan_id}_{timestamp}.json"
     
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(consolidated_1003, f, indent=2, ensure_ascii=False)
+    # Atomic write: the up-to-date check never sees a half-written report
+    _write_atomic(output_path, orjson.dumps(consolidated_1003, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
     
     print()
     print("=" * 80)
@@ -248,15 +437,280 @@ BEGIN CONSOLIDATION. Output complete Form 1003 JSON now:"""
             print(f"   ❌ {section} (missing)")
     
     print()
+    
+    return output_path
+
+
+async def create_completion(**kwargs):
+    """Call chat completions, retrying rate limits and server errors with exponential backoff."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return await get_client().chat.completions.create(**kwargs)
+        except (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError) as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = min(2 ** attempt + random.random(), 60)
+            print(f"⚠️  {type(e).__name__}, retrying in {delay:.1f}s...")
+            await asyncio.sleep(delay)
+
+
+async def consolidate_section(section, doc_json):
+    """Consolidate one Form 1003 section from the given serialized semantic documents."""
+    messages = build_consolidation_messages(doc_json, section)
+    max_completion_tokens = SECTION_COMPLETION_TOKENS
+    while True:
+        response = await create_completion(
+            model=deployment,
+            messages=messages,
+            response_format={"type": "json_object"},
+            max_completion_tokens=max_completion_tokens
+        )
+        choice = response.choices[0]
+        if choice.finish_reason != "length" or max_completion_tokens >= MAX_SECTION_COMPLETION_TOKENS:
+            break
+        max_completion_tokens = min(max_completion_tokens * 2, MAX_SECTION_COMPLETION_TOKENS)
+        print(f"   ⚠️  {section} reply hit the token limit, retrying with {max_completion_tokens} tokens")
+    result = orjson.loads(choice.message.content)
+    print(f"   ✅ {section} ({len(doc_json)} documents)")
+    return result
+
+
+async def consolidate_form_1003(loan_id="1000182227", use_cache=True, force=False):
+    """
+    Consolidate all semantic JSONs into a complete Form 1003.
+    
+    Each schema section is consolidated by its own request, in parallel, from
+    the documents that section draws on; the sections and their data quality
+    notes are then combined into one Form 1003. Unchanged documents reuse the
+    cached consolidation unless use_cache is False, and an up-to-date report
+    (up_to_date_report) is returned as is unless force is True.
+    """
+    
+    print("=" * 80)
+    print(f"Form 1003 Consolidation Agent - Loan {loan_id}")
+    print("=" * 80)
+    print()
+    
+    if not force:
+        up_to_date = up_to_date_report(loan_id)
+        if up_to_date:
+            report_path, report = up_to_date
+            print(f"⏭️  Up-to-date, skipping: {report_path} is newer than the semantic JSON (--force to re-run)")
+            return report
+    
+    # Load schema and semantic data
+    print("📋 Loading Form 1003 schema template...")
+    schema = load_form_1003_schema()
+    
+    print("📁 Loading all semantic JSON files...")
+    semantic_docs = load_all_semantic_json(loan_id)
+    
+    if not semantic_docs:
+        print("❌ No semantic JSON files found!")
+        return None
+    
+    print(f"✅ Loaded {len(semantic_docs)} semantic documents:")
+    for doc_name, doc_data in semantic_docs.items():
+        doc_type = doc_data.get('document_type', 'unknown')
+        print(f"   - {doc_name}: {doc_type}")
+    
+    cache_key = consolidation_cache_key(semantic_docs)
+    cached = load_cached_consolidation(cache_key) if use_cache else None
+    if cached is not None:
+        print()
+        print("♻️  Documents unchanged since a previous consolidation, skipped LLM calls")
+        save_consolidated_1003(loan_id, cached, list(semantic_docs.keys()))
+        print("=" * 80)
+        return cached
+    
+    print()
+    print("=" * 80)
+    print("🤖 Sending to LLM for intelligent consolidation...")
+    print("=" * 80)
+    print()
+    
+    # Missing settings fail here once, not in every section request
+    get_client()
+    
+    # Map: one smaller request per section, all in flight at once, each with
+    # only the documents that section draws on
+    sections = list(schema.get('properties', {}))
+    doc_json = serialize_semantic_docs(semantic_docs)
+    print(f"⏳ Consolidating {len(sections)} sections in parallel...")
+    
+    results = await asyncio.gather(
+        *(consolidate_section(section, {doc_name: doc_json[doc_name] for doc_name in select_section_docs(section, semantic_docs)})
+          for section in sections),
+        return_exceptions=True
+    )
+    
+    # Reduce: stitch the sections together in schema order; a reply without
+    # its section object counts as a failed section
+    consolidated_1003 = {}
+    data_quality_notes = []
+    complete = True
+    for section, result in zip(sections, results):
+        if not isinstance(result, (Exception, dict)) or (isinstance(result, dict) and not isinstance(result.get(section), dict)):
+            result = ValueError(f'reply has no "{section}" object')
+        if isinstance(result, Exception):
+            print(f"❌ {section} failed: {result}")
+            data_quality_notes.append(f"{section}: consolidation failed ({result})")
+            complete = False
+            continue
+        consolidated_1003[section] = result[section]
+        data_quality_notes.extend(result.get('_data_quality_notes') or [])
+    consolidated_1003['_data_quality_notes'] = data_quality_notes
+    
+    # Only complete consolidations are reused
+    if use_cache and complete:
+        save_cached_consolidation(cache_key, consolidated_1003)
+    
+    save_consolidated_1003(loan_id, consolidated_1003, list(semantic_docs.keys()), complete)
+    
     print("=" * 80)
     
     return consolidated_1003
 
 
-if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        loan_id = sys.argv[1]
-    else:
-        loan_id = "1000182227"
+async def consolidate_form_1003_batch(loan_ids, use_cache=True, force=False):
+    """
+    Consolidate Form 1003 for many loans through the Azure OpenAI Batch API.
+    
+    Writes one JSONL request per loan (custom_id = loan_id) for the whole
+    Form 1003 (Batch jobs aren't latency bound), submits a single
+    batch job, polls with exponential backoff until it finishes, then saves
+    each result as that loan's consolidated Form 1003. Loans whose documents
+    are unchanged reuse the cached consolidation instead of being submitted
+    (unless use_cache is False), and loans with an up-to-date report
+    (up_to_date_report) are skipped (unless force is True).
+    """
     
-    consolidate_form_1003(loan_id)
+    print("=" * 80)
+    print(f"Form 1003 Consolidation Batch - {len(loan_ids)} loans")
+    print("=" * 80)
+    print()
+    
+    # Fail on missing settings before reading every loan
+    client = get_client()
+    
+    results = {}
+    source_documents = {}
+    cache_keys = {}
+    with tempfile.NamedTemporaryFile('w', suffix='.jsonl', encoding='utf-8', delete=False) as f:
+        batch_input_path = Path(f.name)
+        for loan_id in loan_ids:
+            up_to_date = None if force else up_to_date_report(loan_id)
+            if up_to_date:
+                report_path, results[loan_id] = up_to_date
+                print(f"⏭️  Up-to-date, skipping {loan_id}: {report_path}")
+                continue
+            print(f"📁 Loading semantic JSON files for {loan_id}...")
+            semantic_docs = load_all_semantic_json(loan_id)
+            if not semantic_docs:
+                print(f"❌ No semantic JSON files found for {loan_id}, skipping")
+                continue
+            cache_key = consolidation_cache_key(semantic_docs)
+            cached = load_cached_consolidation(cache_key) if use_cache else None
+            if cached is not None:
+                print(f"♻️  Documents unchanged for {loan_id}, reusing cached consolidation")
+                save_consolidated_1003(loan_id, cached, list(semantic_docs.keys()))
+                results[loan_id] = cached
+                continue
+            request = {
+                "custom_id": loan_id,
+                "method": "POST",
+                "url": "/chat/completions",
+                "body": {
+                    "model": deployment,
+                    "messages": build_consolidation_messages(serialize_semantic_docs(semantic_docs)),
+                    "response_format": {"type": "json_object"},
+                    "max_completion_tokens": MAX_COMPLETION_TOKENS
+                }
+            }
+            f.write(orjson.dumps(request).decode() + "\n")
+            source_documents[loan_id] = list(semantic_docs.keys())
+            cache_keys[loan_id] = cache_key
+    
+    if not source_documents:
+        batch_input_path.unlink()
+        if not results:
+            print("❌ No loans to submit!")
+        else:
+            print(f"✅ Batch complete: {len(results)}/{len(loan_ids)} loans consolidated")
+        return results
+    
+    try:
+        with open(batch_input_path, 'rb') as f:
+            batch_file = await client.files.create(file=f, purpose="batch")
+    finally:
+        batch_input_path.unlink()
+    
+    batch = await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/chat/completions",
+        completion_window="24h"
+    )
+    print(f"\n📤 Submitted batch {batch.id} ({len(source_documents)} requests)")
+    
+    # Poll with exponential backoff (30s doubling up to 10 minutes)
+    delay = 30
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        print(f"⏳ Batch status: {batch.status} - checking again in {delay}s")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 600)
+        batch = await client.batches.retrieve(batch.id)
+    
+    # Loans already served from up-to-date reports or the cache are kept
+    if batch.status != "completed":
+        print(f"❌ Batch {batch.id} finished with status: {batch.status}")
+        return results
+    
+    # Successful requests are in the output file; requests the service
+    # rejected are only in the error file (same record format)
+    output = "\n".join([
+        (await client.files.content(file_id)).text
+        for file_id in (batch.output_file_id, batch.error_file_id) if file_id
+    ])
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        record = orjson.loads(line)
+        loan_id = record['custom_id']
+        response = record.get('response') or {}
+        if record.get('error') or response.get('status_code') != 200:
+            print(f"❌ Loan {loan_id} failed: {record.get('error') or response.get('body')}")
+            continue
+        
+        try:
+            consolidated_1003 = orjson.loads(response['body']['choices'][0]['message']['content'])
+        except Exception as e:
+            print(f"❌ Loan {loan_id}: could not parse response: {e}")
+            continue
+        
+        if use_cache:
+            save_cached_consolidation(cache_keys[loan_id], consolidated_1003)
+        print(f"\nLoan {loan_id}")
+        save_consolidated_1003(loan_id, consolidated_1003, source_documents[loan_id])
+        results[loan_id] = consolidated_1003
+    
+    print(f"✅ Batch complete: {len(results)}/{len(loan_ids)} loans consolidated")
+    return results
+
+
+def main():
+    args = sys.argv[1:]
+    loan_ids = [arg for arg in args if arg not in ("--batch", "--no-cache", "--force")]
+    use_cache = "--no-cache" not in args
+    force = "--force" in args
+    
+    if "--batch" in args:
+        # No loan ids given: every loan with semantic JSON
+        if not loan_ids:
+            loan_ids = sorted(path.parent.name for path in Path("loan_docs").glob("*/semantic_json"))
+        asyncio.run(consolidate_form_1003_batch(loan_ids, use_cache, force))
+    else:
+        asyncio.run(consolidate_form_1003(loan_ids[0] if loan_ids else "1000182227", use_cache, force))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,16 +6,141 @@ using generally accepted mortgage underwriting standards.
 """
 
 import json
+import orjson
 import sys
 import os
+import random
 import asyncio
+import tempfile
 from pathlib import Path
+from dataclasses import dataclass
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from openai import AsyncAzureOpenAI
+from openai import AsyncAzureOpenAI, RateLimitError, APITimeoutError, APIConnectionError, InternalServerError
 
 # Load environment variables
 load_dotenv()
 
+# Azure OpenAI configuration
+AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
+AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_KEY")
+AZURE_OPENAI_DEPLOYMENT = os.getenv("AZURE_OPENAI_DEPLOYMENT")
+AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview")
+
+# Threads used to read and parse a loan's semantic JSON files
+MAX_READ_WORKERS = 16
+# Document types analyzed for income
+INCOME_DOCUMENT_TYPES = ('paystub', 'w2', 'form_1099-r')
+_INCOME_TYPE_MARKERS = tuple(t.encode() for t in INCOME_DOCUMENT_TYPES)
+
+# LLM calls in flight at once (consistency runs fan out num_runs requests);
+# the semaphore enforcing it is created inside the running event loop
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+MAX_RETRIES = 3
+
+# Shared Azure OpenAI client (one connection pool for every run), created on
+# first use so report-only code paths don't need credentials
+_client = None
+
+def get_client():
+    """Return the shared Azure OpenAI client, creating it on first use."""
+    global _client
+    if _client is None:
+        _client = AsyncAzureOpenAI(
+            api_key=AZURE_OPENAI_API_KEY,
+            api_version=AZURE_OPENAI_API_VERSION,
+            azure_endpoint=AZURE_OPENAI_ENDPOINT
+        )
+    return _client
+
+
+async def close_client():
+    """Close the shared client's connections (call before the event loop ends)."""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+@dataclass
+class IncomeDoc:
+    """An income document (paystub, W2 or 1099-R) as sent to the model."""
+    # dataclass(slots=True) needs Python 3.10; hand-declared slots work since no field has a default
+    __slots__ = ('file_id', 'file_name', 'document_type', 'upload_date', 'semantic_content')
+    file_id: Optional[str]
+    file_name: Optional[str]
+    document_type: str
+    upload_date: Optional[str]
+    semantic_content: dict
+
+
+def _drop_empty(value):
+    """Recursively drop None, empty strings and empty containers from semantic content."""
+    if isinstance(value, dict):
+        pruned = {key: _drop_empty(item) for key, item in value.items()}
+        return {key: item for key, item in pruned.items() if item not in (None, "", [], {})}
+    if isinstance(value, list):
+        pruned = [_drop_empty(item) for item in value]
+        return [item for item in pruned if item not in (None, "", [], {})]
+    return value
+
+
+def _load_income_document(json_file):
+    """
+    Load one semantic JSON file and keep it if it is an income document.
+    
+    Returns the income document, None if it is another document type, or the
+    exception raised while loading it.
+    """
+    try:
+        with open(json_file, 'rb') as f:
+            raw = f.read()
+        
+        # Most of a loan's documents aren't income documents: skip parsing any
+        # file that can't contain an income document type
+        lowered = raw.lower()
+        if not any(marker in lowered for marker in _INCOME_TYPE_MARKERS):
+            return None
+        doc = orjson.loads(raw)
+        
+        # Check if document_type is paystub, w2, or 1099-r
+        doc_type = doc.get('semantic_content', {}).get('document_type', '').lower()
+        
+        if doc_type in INCOME_DOCUMENT_TYPES:
+            metadata = doc.get('metadata', {})
+            return IncomeDoc(
+                file_id=metadata.get('FileId'),
+                file_name=metadata.get('FileName'),
+                document_type=doc_type,
+                upload_date=metadata.get('FileUploadDate'),
+                # Empty fields carry no income information, only prompt tokens
+                semantic_content=_drop_empty(doc.get('semantic_content', {}))
+            )
+        return None
+        
+    except Exception as e:
+        return e
+
+
+async def create_completion(semaphore, **kwargs):
+    """
+    Call chat completions while holding semaphore (which caps the requests in
+    flight), retrying rate limits, timeouts and server errors with exponential
+    backoff.
+    """
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            async with semaphore:
+                return await get_client().chat.completions.create(**kwargs)
+        except (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError) as e:
+            if attempt == MAX_RETRIES:
+                raise
+            delay = min(2 ** attempt + random.random(), 60)
+            print(f">> {type(e).__name__}, retrying in {delay:.1f}s...")
+            await asyncio.sleep(delay)
+
+
 def load_income_documents(loan_id):
     """
     Load all paystub and W2 documents from semantic_json directory.
@@ -24,7 +149,7 @@ def load_income_documents(loan_id):
         loan_id: The loan identifier
         
     Returns:
-        List of document objects containing paystubs and W2s
+        List of IncomeDoc objects for the paystubs, W2s and 1099-Rs
     """
     semantic_dir = Path(f"loan_docs/{loan_id}/semantic_json")
     
@@ -33,60 +158,28 @@ def load_income_documents(loan_id):
         return []
     
     income_docs = []
-    
-    for json_file in semantic_dir.glob("*.json"):
-        try:
-            with open(json_file, 'r', encoding='utf-8') as f:
-                doc = json.load(f)
-                
-            # Check if document_type is paystub, w2, or 1099-r
-            doc_type = doc.get('semantic_content', {}).get('document_type', '').lower()
-            
-            if doc_type in ['paystub', 'w2', 'form_1099-r']:
-                income_docs.append({
-                    'file_id': doc.get('metadata', {}).get('FileId'),
-                    'file_name': doc.get('metadata', {}).get('FileName'),
-                    'document_type': doc_type,
-                    'upload_date': doc.get('metadata', {}).get('FileUploadDate'),
-                    'semantic_content': doc.get('semantic_content', {})
-                })
-                print(f">> Loaded {doc_type}: {doc.get('metadata', {}).get('FileName')}")
-                
-        except Exception as e:
-            print(f"Error loading {json_file}: {e}")
-            continue
+    # scandir hands back plain path strings; no Path objects or glob matching
+    with os.scandir(semantic_dir) as entries:
+        json_files = [entry.path for entry in entries
+                      if entry.name.endswith('.json') and entry.is_file()]
+    
+    # File reads are I/O bound: load them on a thread pool (results keep file order)
+    with ThreadPoolExecutor(max_workers=MAX_READ_WORKERS) as executor:
+        for json_file, doc in zip(json_files, executor.map(_load_income_document, json_files)):
+            if isinstance(doc, Exception):
+                print(f"Error loading {json_file}: {doc}")
+            elif doc is not None:
+                income_docs.append(doc)
+                print(f">> Loaded {doc.document_type}: {doc.file_name}")
     
     return income_docs
 
 
-async def analyze_income(income_docs, loan_id, run_number=1):
-    """
-    Use Azure OpenAI to analyze income documents and calculate monthly income
-    using generally accepted mortgage underwriting standards.
-    
-    Args:
-        income_docs: List of income document objects
-        loan_id: The loan identifier
-        run_number: Run number for this analysis
-        
-    Returns:
-        Dict containing income analysis results
-    """
-    if not income_docs:
-        return {"error": "No income documents found"}
-    
-    # Initialize Azure OpenAI client
-    client = AsyncAzureOpenAI(
-        api_key=os.getenv("AZURE_OPENAI_KEY"),
-        api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview"),
-        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-    )
-    
-    # Create prompt with income documents
-    prompt = f"""You are a mortgage underwriting income analyst. Analyze the following income documents and calculate the borrower's monthly income using generally accepted mortgage underwriting standards.
+# Static instructions and output schema: identical on every call, so they lead
+# the request (system message) where the service can cache the prompt prefix
+INCOME_SYSTEM_PROMPT = """You are an expert mortgage underwriter specializing in income analysis. You follow Fannie Mae and Freddie Mac guidelines for income calculation.
 
-INCOME DOCUMENTS:
-{json.dumps(income_docs, indent=2)}
+You are a mortgage underwriting income analyst. Analyze the income documents provided by the user and calculate the borrower's monthly income using generally accepted mortgage underwriting standards.
 
 INSTRUCTIONS:
 1. Review all paystubs, W2 documents, and 1099-R forms provided
@@ -102,48 +195,73 @@ INSTRUCTIONS:
 4. Provide detailed methodology showing how you arrived at the calculation
 
 Return ONLY a JSON object with this structure (no markdown, no code blocks):
-{{
+{
   "monthly_gross_income": <number>,
-  "calculation_methodology": {{
+  "calculation_methodology": {
     "paystubs_analysis": "<detailed explanation of paystub calculations>",
     "w2_analysis": "<detailed explanation of W2 calculations>",
     "reconciliation": "<how paystubs and W2s reconcile or any discrepancies>",
-    "income_components": {{
+    "income_components": {
       "base_salary": <number>,
       "overtime": <number>,
       "bonus": <number>,
       "commission": <number>,
       "other": <number>
-    }},
+    },
     "pay_frequency": "<weekly|bi-weekly|semi-monthly|monthly>",
     "calculation_steps": [
       "<step 1>",
       "<step 2>",
       "..."
     ]
-  }},
+  },
   "confidence_level": "<high|medium|low>",
   "notes": "<any additional notes or concerns>"
-}}"""
+}"""
 
+
+def build_income_messages(income_docs):
+    """Build the chat messages asking the model for the monthly income calculation."""
+    return [
+        {
+            "role": "system",
+            "content": INCOME_SYSTEM_PROMPT
+        },
+        {
+            "role": "user",
+            "content": f"INCOME DOCUMENTS:\n{orjson.dumps(income_docs, option=orjson.OPT_NON_STR_KEYS).decode()}"
+        }
+    ]
+
+
+async def analyze_income(income_docs, loan_id, run_number=1, semaphore=None):
+    """
+    Use Azure OpenAI to analyze income documents and calculate monthly income
+    using generally accepted mortgage underwriting standards.
+    
+    Args:
+        income_docs: List of income document objects
+        loan_id: The loan identifier
+        run_number: Run number for this analysis
+        semaphore: Limits the LLM calls in flight (shared by concurrent runs);
+            a new LLM_MAX_CONCURRENCY semaphore if None
+        
+    Returns:
+        Dict containing income analysis results
+    """
+    if not income_docs:
+        return {"error": "No income documents found"}
+    
     print("\n" + "="*80)
     print(f"INCOME ANALYSIS RUN {run_number} - LOAN {loan_id}")
     print("="*80)
     print(f"Analyzing {len(income_docs)} income documents...")
     
     try:
-        response = await client.chat.completions.create(
-            model=os.getenv("AZURE_OPENAI_DEPLOYMENT"),
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert mortgage underwriter specializing in income analysis. You follow Fannie Mae and Freddie Mac guidelines for income calculation."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
+        response = await create_completion(
+            semaphore or asyncio.Semaphore(LLM_MAX_CONCURRENCY),
+            model=AZURE_OPENAI_DEPLOYMENT,
+            messages=build_income_messages(income_docs),
             response_format={"type": "json_object"}
         )
         
@@ -158,17 +276,93 @@ Return ONLY a JSON object with this structure (no markdown, no code blocks):
         return {"error": str(e)}
 
 
+async def analyze_income_batch(income_docs, loan_id, num_runs):
+    """
+    Run all consistency runs through the Azure OpenAI Batch API (half the cost
+    of real-time calls, results within the 24h completion window).
+    
+    Args:
+        income_docs: List of income document objects
+        loan_id: The loan identifier
+        num_runs: Number of identical analyses to submit
+        
+    Returns:
+        List of income analysis results in run order
+    """
+    client = get_client()
+    
+    # One JSONL request per run; the prompt is identical, so serialize it once
+    body = orjson.dumps({
+        "model": AZURE_OPENAI_DEPLOYMENT,
+        "messages": build_income_messages(income_docs),
+        "response_format": {"type": "json_object"}
+    }).decode()
+    with tempfile.NamedTemporaryFile('w', suffix='.jsonl', encoding='utf-8', delete=False) as f:
+        batch_input_path = Path(f.name)
+        for i in range(1, num_runs + 1):
+            f.write(f'{{"custom_id": "run{i}", "method": "POST", "url": "/chat/completions", "body": {body}}}\n')
+    
+    try:
+        with open(batch_input_path, 'rb') as f:
+            batch_file = await client.files.create(file=f, purpose="batch")
+    finally:
+        batch_input_path.unlink()
+    
+    batch = await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/chat/completions",
+        completion_window="24h"
+    )
+    print(f"\n>> Submitted batch {batch.id} ({num_runs} runs for loan {loan_id})")
+    
+    # Poll with exponential backoff (30s doubling up to 10 minutes)
+    delay = 30
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        print(f">> Batch status: {batch.status} - checking again in {delay}s")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 600)
+        batch = await client.batches.retrieve(batch.id)
+    
+    results = {}
+    if batch.status == "completed":
+        # Successful runs are in the output file; runs the service rejected
+        # are only in the error file (same record format)
+        output = "\n".join([
+            (await client.files.content(file_id)).text
+            for file_id in (batch.output_file_id, batch.error_file_id) if file_id
+        ])
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            record = orjson.loads(line)
+            run_number = int(record['custom_id'][len('run'):])
+            response = record.get('response') or {}
+            if record.get('error') or response.get('status_code') != 200:
+                results[run_number] = {"error": str(record.get('error') or response.get('body'))}
+                print(f"Error: run {run_number} failed: {results[run_number]['error']}")
+                continue
+            try:
+                result = orjson.loads(response['body']['choices'][0]['message']['content'])
+            except Exception as e:
+                results[run_number] = {"error": str(e)}
+                continue
+            print(f">> RUN {run_number} COMPLETE - Monthly Gross Income: ${result.get('monthly_gross_income', 0):,.2f}")
+            results[run_number] = result
+    else:
+        print(f"Error: batch {batch.id} finished with status: {batch.status}")
+    
+    missing = {"error": f"No result from batch {batch.id} ({batch.status})"}
+    return [results.get(i, dict(missing)) for i in range(1, num_runs + 1)]
+
+
 def save_analysis(result, loan_id, run_number=1):
     """Save the income analysis result to a JSON file."""
     output_dir = Path("reports")
     output_dir.mkdir(exist_ok=True)
     
     output_file = output_dir / f"income_analysis_{loan_id}_run{run_number}.json"
+    output_file.write_bytes(orjson.dumps(result, option=orjson.OPT_INDENT_2))
     
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(result, f, indent=2)
-    
-    print(f">> Run {run_number} saved to: {output_file}")
     return output_file
 
 
@@ -221,7 +415,9 @@ def create_html_report(loan_id):
     max_run = summary['results'][max_run_num - 1]
     min_run = summary['results'][min_run_num - 1]
     
-    html = f"""<!DOCTYPE html>
+    parts = []
+    add = parts.append
+    add(f"""<!DOCTYPE html>
 <html>
 <head>
     <meta charset='UTF-8'>
@@ -276,12 +472,12 @@ def create_html_report(loan_id):
         <div class='documents-list'>
             <h4>Income Documents Used:</h4>
             <ul>
-"""
+""")
     
     for doc in summary['income_documents']:
-        html += f"                <li><strong>{doc['type'].upper()}</strong>: {doc['file_name']}</li>\n"
+        add(f"                <li><strong>{doc['type'].upper()}</strong>: {doc['file_name']}</li>\n")
     
-    html += f"""            </ul>
+    add(f"""            </ul>
         </div>
         
         <div class='stats-grid'>
@@ -312,29 +508,29 @@ def create_html_report(loan_id):
                     <th>Confidence</th>
                     <th>Pay Frequency</th>
                 </tr>
-"""
+""")
     
     for result in summary['results']:
         if 'error' not in result:
-            html += f"""                <tr>
+            add(f"""                <tr>
                     <td>Run {result['run_number']}</td>
                     <td>${result['monthly_gross_income']:,.2f}</td>
                     <td><span class='confidence-{result['confidence_level']}'>{result['confidence_level'].upper()}</span></td>
                     <td>{result['calculation_methodology']['pay_frequency']}</td>
                 </tr>
-"""
+""")
     
-    html += """            </table>
+    add("""            </table>
         </div>
     </div>
-"""
+""")
     
     # Add section describing each distinct methodology
-    html += f"""    <div class='overview'>
+    add(f"""    <div class='overview'>
         <h3>Distinct Calculation Methodologies</h3>
         <p>The model produced <strong>{len(sorted_income_groups)} different income calculations</strong> across {summary['num_runs']} runs. Below are the methodologies ordered by frequency:</p>
     </div>
-"""
+""")
     
     # Add detailed analysis for each distinct methodology (ordered by frequency)
     for method_num, (income, runs) in enumerate(sorted_income_groups, 1):
@@ -359,7 +555,7 @@ def create_html_report(loan_id):
             header_class = ""
             frequency_label = f"METHOD {method_num}"
         
-        html += f"""    <div class='run-section'>
+        add(f"""    <div class='run-section'>
         <div class='run-header {header_class}'>Method {method_num}: ${income:,.2f} - {frequency_label} ({frequency}/{summary['num_runs']} runs = {frequency_pct:.1f}%)</div>
         <p><strong>Occurred in runs:</strong> {run_numbers_str}</p>
         
@@ -405,12 +601,12 @@ def create_html_report(loan_id):
             <h4>Calculation Steps</h4>
             <div class='steps'>
                 <ol>
-"""
+""")
         
         for step in methodology['calculation_steps']:
-            html += f"                    <li>{step}</li>\n"
+            add(f"                    <li>{step}</li>\n")
         
-        html += f"""                </ol>
+        add(f"""                </ol>
             </div>
         </div>
         
@@ -419,21 +615,21 @@ def create_html_report(loan_id):
             <p>{representative_run.get('notes', 'No additional notes')}</p>
         </div>
     </div>
-"""
+""")
     
     # Add detailed analysis for highest and lowest runs (if different from methodologies already shown)
-    html += """    <div class='overview'>
+    add("""    <div class='overview'>
         <h3>Extreme Results Detail</h3>
         <p>Below are the specific runs that produced the highest and lowest income calculations:</p>
     </div>
-"""
+""")
     
     for run_data, run_label, header_class in [(max_run, f"HIGHEST INCOME - Run {max_run_num}", "max"), 
                                                 (min_run, f"LOWEST INCOME - Run {min_run_num}", "min")]:
         methodology = run_data['calculation_methodology']
         income_comp = methodology['income_components']
         
-        html += f"""    <div class='run-section'>
+        add(f"""    <div class='run-section'>
         <div class='run-header {header_class}'>{run_label} - ${run_data['monthly_gross_income']:,.2f} <span class='confidence-{run_data['confidence_level']}'>{run_data['confidence_level'].upper()} CONFIDENCE</span></div>
         
         <div class='income-breakdown'>
@@ -478,12 +674,12 @@ def create_html_report(loan_id):
             <h4>Calculation Steps</h4>
             <div class='steps'>
                 <ol>
-"""
+""")
         
         for step in methodology['calculation_steps']:
-            html += f"                    <li>{step}</li>\n"
+            add(f"                    <li>{step}</li>\n")
         
-        html += f"""                </ol>
+        add(f"""                </ol>
             </div>
         </div>
         
@@ -492,9 +688,9 @@ def create_html_report(loan_id):
             <p>{run_data.get('notes', 'No additional notes')}</p>
         </div>
     </div>
-"""
+""")
     
-    html += f"""    <div class='overview'>
+    add(f"""    <div class='overview'>
         <h3>Consistency Analysis</h3>
         <p><strong>Variance:</strong> ${stats['variance']:,.2f} ({stats['variance_percentage']:.2f}%)</p>
         <p><strong>Consistency Rating:</strong> <span class='confidence-{variance_class}'>{consistency_rating}</span></p>
@@ -502,12 +698,12 @@ def create_html_report(loan_id):
     </div>
 </body>
 </html>
-"""
+""")
     
     # Save HTML file
     output_file = Path(f"reports/income_analysis_consistency_report_{loan_id}.html")
     with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(html)
+        f.write(''.join(parts))
     
     print(f"\n>> HTML report created: {output_file}")
     print(f"\nSummary:")
@@ -516,24 +712,63 @@ def create_html_report(loan_id):
     print(f"  Consistency: {consistency_rating}")
 
 
-def run_consistency_test(loan_id, num_runs=3):
+def run_consistency_test(loan_id, num_runs=3, batch=False):
     """
     Run the income analysis multiple times to test consistency.
     
     Args:
         loan_id: The loan identifier
         num_runs: Number of times to run the analysis
+        batch: Submit the runs through the Batch API instead of real-time calls
+    """
+    async def run():
+        try:
+            await run_consistency_test_async(loan_id, num_runs, batch)
+        finally:
+            await close_client()
+    
+    asyncio.run(run())
+
+
+def run_consistency_tests(loan_ids, num_runs=3, batch=False):
+    """
+    Run the consistency test for several loans concurrently in one process.
+    
+    All loans share the client and the LLM_MAX_CONCURRENCY limit; a failure
+    in one loan is reported without stopping the others.
+    
+    Args:
+        loan_ids: The loan identifiers
+        num_runs: Number of times to run the analysis per loan
+        batch: Submit the runs through the Batch API instead of real-time calls
     """
-    asyncio.run(run_consistency_test_async(loan_id, num_runs))
+    async def run_one(loan_id, semaphore):
+        try:
+            await run_consistency_test_async(loan_id, num_runs, batch, semaphore)
+        except Exception as e:
+            print(f"Error: consistency test for loan {loan_id} failed: {e}")
+    
+    async def run():
+        # Created in this event loop, and shared by every loan's runs
+        semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        try:
+            await asyncio.gather(*(run_one(loan_id, semaphore) for loan_id in loan_ids))
+        finally:
+            await close_client()
+    
+    asyncio.run(run())
 
 
-async def run_consistency_test_async(loan_id, num_runs=3):
+async def run_consistency_test_async(loan_id, num_runs=3, batch=False, semaphore=None):
     """
     Run the income analysis multiple times asynchronously to test consistency.
     
     Args:
         loan_id: The loan identifier
         num_runs: Number of times to run the analysis
+        batch: Submit the runs through the Batch API instead of real-time calls
+        semaphore: Limits the LLM calls in flight (shared across loans); a new
+            LLM_MAX_CONCURRENCY semaphore if None
     """
     print("\n" + "="*80)
     print(f"INCOME ANALYSIS CONSISTENCY TEST (ASYNC)")
@@ -550,23 +785,34 @@ async def run_consistency_test_async(loan_id, num_runs=3):
     
     print(f"\nFound {len(income_docs)} income documents:")
     for doc in income_docs:
-        print(f"  - {doc['document_type'].upper()}: {doc['file_name']}")
-    
-    print(f"\n>> Starting {num_runs} parallel analyses...")
+        print(f"  - {doc.document_type.upper()}: {doc.file_name}")
     
-    # Run analysis multiple times in parallel
-    tasks = []
-    for i in range(1, num_runs + 1):
-        tasks.append(analyze_income(income_docs, loan_id, run_number=i))
-    
-    results = await asyncio.gather(*tasks)
+    if batch:
+        print(f"\n>> Submitting {num_runs} analyses as a batch job...")
+        results = await analyze_income_batch(income_docs, loan_id, num_runs)
+    else:
+        print(f"\n>> Starting {num_runs} parallel analyses...")
+        
+        # Run analysis multiple times in parallel, under one concurrency limit
+        semaphore = semaphore or asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        tasks = []
+        for i in range(1, num_runs + 1):
+            tasks.append(analyze_income(income_docs, loan_id, run_number=i, semaphore=semaphore))
+        
+        results = await asyncio.gather(*tasks)
     
-    # Save individual results
+    # Save individual results (independent files, written concurrently)
     for i, result in enumerate(results, 1):
         result['run_number'] = i
         result['loan_id'] = loan_id
         result['documents_analyzed'] = len(income_docs)
-        save_analysis(result, loan_id, run_number=i)
+    
+    output_files = await asyncio.gather(*(
+        asyncio.to_thread(save_analysis, result, loan_id, run_number=i)
+        for i, result in enumerate(results, 1)
+    ))
+    for i, output_file in enumerate(output_files, 1):
+        print(f">> Run {i} saved to: {output_file}")
     
     # Summary of consistency
     print("\n" + "="*80)
@@ -606,7 +852,7 @@ async def run_consistency_test_async(loan_id, num_runs=3):
         'loan_id': loan_id,
         'num_runs': num_runs,
         'documents_analyzed': len(income_docs),
-        'income_documents': [{'type': d['document_type'], 'file_name': d['file_name']} for d in income_docs],
+        'income_documents': [{'type': d.document_type, 'file_name': d.file_name} for d in income_docs],
         'results': results,
         'statistics': {
             'average_income': avg_income,
@@ -631,12 +877,19 @@ async def run_consistency_test_async(loan_id, num_runs=3):
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python income_analysis_agent.py <loan_id> [num_runs]")
+    args = [arg for arg in sys.argv[1:] if arg != "--batch"]
+    batch_mode = "--batch" in sys.argv[1:]
+    
+    if not args:
+        print("Usage: python income_analysis_agent.py <loan_id>[,<loan_id>...] [num_runs] [--batch]")
         print("Example: python income_analysis_agent.py 1000179167 3")
+        print("Example: python income_analysis_agent.py 1000179167,1000182227 3")
         sys.exit(1)
     
-    loan_id = sys.argv[1]
-    num_runs = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    loan_ids = [loan_id for loan_id in args[0].split(",") if loan_id]
+    num_runs = int(args[1]) if len(args) > 1 else 3
     
-    run_consistency_test(loan_id, num_runs)
+    if len(loan_ids) == 1:
+        run_consistency_test(loan_ids[0], num_runs, batch_mode)
+    else:
+        run_consistency_tests(loan_ids, num_runs, batch_mode)